@@ -1,37 +1,86 @@
 """Live analytics page for the StreamLit dashboard, showing live graph visualisations."""
 from datetime import datetime
 from os import environ
+from threading import Lock
 from requests import get
 
 from dotenv import load_dotenv
 import pandas as pd
 
 import altair as alt
-from psycopg2 import extensions, connect
+from psycopg2 import extensions, connect, InterfaceError, OperationalError
 import streamlit as st
 from vega_datasets import data
 
 # pylint: disable=E1136
 
 
+def is_connection_alive(connection: extensions.connection) -> bool:
+    """
+    Returns whether the database still answers on the shared connection,
+    so a connection dropped by a database restart or an idle timeout is replaced.
+    """
+    if connection is None or connection.closed:
+        return False
+    try:
+        with connection.cursor() as curr:
+            curr.execute("SELECT 1;")
+        return True
+    except (InterfaceError, OperationalError):
+        return False
+
+
+@st.cache_resource(validate=is_connection_alive)
 def get_db_connection() -> extensions.connection:
-    """Returns a connection to the AWS Bandcamp database"""
+    """
+    Returns a connection to the AWS Bandcamp database,
+    shared between reruns so prepared statements are reused.
+    A new connection is made whenever the shared one has stopped answering.
+    """
     try:
-        return connect(user=environ["DB_USER"],
-                       password=environ["DB_PASSWORD"],
-                       host=environ["DB_IP"],
-                       port=environ["DB_PORT"],
-                       database=environ["DB_NAME"])
+        connection = connect(user=environ["DB_USER"],
+                             password=environ["DB_PASSWORD"],
+                             host=environ["DB_IP"],
+                             port=environ["DB_PORT"],
+                             database=environ["DB_NAME"])
+        # the connection is shared between reruns, so don't hold a transaction open
+        connection.autocommit = True
+        return connection
     except ConnectionError:
         print("Error: Cannot connect to the database")
         return None
 
 
+@st.cache_resource
+def get_prepared_statements() -> tuple[set, Lock]:
+    """
+    Returns the set of statements prepared on the shared connection, and a lock so
+    only one session prepares each statement. Streamlit runs this script afresh on
+    every rerun, so they are cached alongside the connection.
+    """
+    return set(), Lock()
+
+
+def execute_prepared(cursor: extensions.cursor, name: str, query: str, params: tuple) -> None:
+    """
+    Executes a query with bound parameters ($1, $2...) as a server-side prepared statement,
+    so the database only plans it once per connection.
+    """
+    prepared_statements, lock = get_prepared_statements()
+    statement = (cursor.connection.get_backend_pid(), name)
+    with lock:
+        if statement not in prepared_statements:
+            cursor.execute(f"PREPARE {name} AS {query}")
+            prepared_statements.add(statement)
+
+    cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))});", params)
+
+
 @st.cache_data
 def loading_sales_data(_db_connection: extensions.connection, start_time, end_time) -> pd.DataFrame:
     """Loads all the artist, track and album sale data in a given timeframe."""
     with _db_connection.cursor() as curr:
-        curr.execute(f"""
+        execute_prepared(curr, "sales_data", """
                     SELECT sale_event.sale_id, sale_event.sale_time, item.item_name, item.item_type_id, artist.artist_name
                     FROM sale_event
                     JOIN item
@@ -40,8 +89,9 @@ def loading_sales_data(_db_connection: extensions.connection, start_time, end_ti
                     ON artist.artist_id = item.artist_id
                     JOIN item_genre
                     ON item_genre.item_id = item.item_id
-                    WHERE sale_event.sale_time >= '{start_time}'
-                    AND sale_event.sale_time <= '{end_time}';""")
+                    WHERE sale_event.sale_time >= $1
+                    AND sale_event.sale_time <= $2""",
+                     (start_time, end_time))
         tuples = curr.fetchall()
         column_names = ['sale_id', 'sale_time',
                         'item_name', 'item_type', 'artist']
@@ -52,7 +102,7 @@ def loading_sales_data(_db_connection: extensions.connection, start_time, end_ti
 def loading_sale_genres(_db_connection: extensions.connection, start_time, end_time) -> pd.DataFrame:
     """Loads all the genre sale data in a given timeframe."""
     with _db_connection.cursor() as curr:
-        curr.execute(f"""
+        execute_prepared(curr, "sale_genres", """
                     SELECT sale_event.sale_id, sale_event.sale_time, item.item_name, genre.genre
                     FROM sale_event
                     JOIN item
@@ -61,8 +111,9 @@ def loading_sale_genres(_db_connection: extensions.connection, start_time, end_t
                     ON item_genre.item_id = item.item_id
                     JOIN genre
                     ON genre.genre_id = item_genre.genre_id
-                    WHERE sale_event.sale_time >= '{start_time}' 
-                    AND sale_event.sale_time <= '{end_time}';""")
+                    WHERE sale_event.sale_time >= $1 
+                    AND sale_event.sale_time <= $2""",
+                     (start_time, end_time))
         tuples = curr.fetchall()
         column_names = ['sale_id', 'sale_time',
                         'item_name', 'genre']
@@ -73,8 +124,9 @@ def loading_sale_genres(_db_connection: extensions.connection, start_time, end_t
 def loading_track_data(_db_connection, start_time, end_time, track_name) -> pd.DataFrame:
     """Loads the artist, album, genre sale data for a given track or album in a given timeframe."""
     with _db_connection.cursor() as curr:
-        curr.execute(f"""
-                    SELECT sale_event.*, country.country, item.item_name, item.item_type_id, item.item_image, artist.artist_name, genre.genre
+        execute_prepared(curr, "track_data", """
+                    SELECT sale_event.sale_id, sale_event.sale_time, sale_event.amount, sale_event.item_id, sale_event.country_id,
+                        country.country, item.item_name, item.item_type_id, item.item_image, artist.artist_name, genre.genre
                     FROM sale_event
                     JOIN country
                     ON country.country_id = sale_event.country_id
@@ -86,9 +138,10 @@ def loading_track_data(_db_connection, start_time, end_time, track_name) -> pd.D
                     ON item_genre.item_id = item.item_id
                     JOIN genre
                     ON genre.genre_id = item_genre.genre_id
-                    WHERE item.item_name = '{track_name}'
-                    AND sale_event.sale_time >= '{start_time}' 
-                    AND sale_event.sale_time <= '{end_time}';""")
+                    WHERE item.item_name = $1
+                    AND sale_event.sale_time >= $2 
+                    AND sale_event.sale_time <= $3""",
+                     (track_name, start_time, end_time))
         tuples = curr.fetchall()
         column_names = ['sale_id', 'sale_time', 'amount', 'item_id', 'country_id',
                         'country', 'item_name', 'item_type',
@@ -100,8 +153,9 @@ def loading_track_data(_db_connection, start_time, end_time, track_name) -> pd.D
 def get_artist_data(_db_connection: extensions.connection, start_time, end_time, artist_name) -> pd.DataFrame:
     """Loads all the artist, album, genre sale data for a given artist in a given timeframe."""
     with _db_connection.cursor() as curr:
-        curr.execute(f"""
-                    SELECT sale_event.*, country.country, item.item_name, item.item_type_id, item.item_image, artist.artist_name, genre.genre
+        execute_prepared(curr, "artist_data", """
+                    SELECT sale_event.sale_id, sale_event.sale_time, sale_event.amount, sale_event.item_id, sale_event.country_id,
+                        country.country, item.item_name, item.item_type_id, item.item_image, artist.artist_name, genre.genre
                     FROM sale_event
                     JOIN country
                     ON country.country_id = sale_event.country_id
@@ -113,9 +167,10 @@ def get_artist_data(_db_connection: extensions.connection, start_time, end_time,
                     ON item_genre.item_id = item.item_id
                     JOIN genre
                     ON genre.genre_id = item_genre.genre_id
-                    WHERE artist.artist_name = '{artist_name}'
-                    AND sale_event.sale_time >= '{start_time}' 
-                    AND sale_event.sale_time <= '{end_time}';""")
+                    WHERE artist.artist_name = $1
+                    AND sale_event.sale_time >= $2 
+                    AND sale_event.sale_time <= $3""",
+                     (artist_name, start_time, end_time))
         tuples = curr.fetchall()
         column_names = ['sale_id', 'sale_time', 'amount', 'item_id', 'country_id',
                         'country', 'item_name', 'item_type',
@@ -127,7 +182,7 @@ def get_artist_data(_db_connection: extensions.connection, start_time, end_time,
 def loading_genre_and_countries(_db_connection, start_time, end_time) -> pd.DataFrame:
     """Loads the genre and country data required for the heat map."""
     with _db_connection.cursor() as curr:
-        curr.execute(f"""
+        execute_prepared(curr, "genre_and_countries", """
                     SELECT country.country, genre.genre
                     FROM sale_event
                     JOIN item
@@ -138,8 +193,9 @@ def loading_genre_and_countries(_db_connection, start_time, end_time) -> pd.Data
                     ON genre.genre_id = item_genre.genre_id
                     JOIN country
                     ON country.country_id = sale_event.country_id
-                    WHERE sale_event.sale_time >= '{start_time}' 
-                    AND sale_event.sale_time <= '{end_time}';""")
+                    WHERE sale_event.sale_time >= $1 
+                    AND sale_event.sale_time <= $2""",
+                     (start_time, end_time))
         tuples = curr.fetchall()
         column_names = ['country', 'genre']
         return pd.DataFrame(tuples, columns=column_names)
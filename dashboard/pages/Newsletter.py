@@ -36,7 +36,8 @@ def add_subscriber(connection, user_email):
     """Adds the email address to the subscriber table in the database."""
     with connection.cursor() as cur:
         cur.execute(
-            f"INSERT INTO subscribers(subscriber_email) VALUES ('{user_email}') ON CONFLICT DO NOTHING;")
+            "INSERT INTO subscribers(subscriber_email) VALUES (%s) ON CONFLICT DO NOTHING;",
+            (user_email,))
         connection.commit()
 
 
@@ -0,0 +1,156 @@
+"""
+Script which caches the metadata scraped from Bandcamp item pages,
+so popular albums / tracks don't have to be scraped again on every sale,
+and the result of cleaning each tag, so the NLP model only sees new tags.
+"""
+
+from collections import OrderedDict
+import json
+import sqlite3
+from time import time
+from typing import Optional
+
+CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+CACHE_MAX_ENTRIES = 50000
+TAG_CACHE_SIZE = 10000
+
+
+class PageCache:
+    """
+    A persistent cache, stored in a SQLite file, of the title and tags of an item page
+    keyed by the url of the page. Entries expire after ttl seconds and the oldest entries
+    are evicted once the cache holds more than max_entries.
+    """
+
+    def __init__(self, path: str, ttl: int = CACHE_TTL_SECONDS,
+                 max_entries: int = CACHE_MAX_ENTRIES) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS page(
+                url TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                tags TEXT NOT NULL,
+                cached_at REAL NOT NULL
+            );""")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS page_cached_at ON page(cached_at);")
+        self.connection.commit()
+
+    def get(self, url: str) -> Optional[dict]:
+        """
+        Returns the cached title and tags for the url, or None if the url
+        is not cached or its entry has expired.
+        """
+        row = self.connection.execute(
+            "SELECT title, tags FROM page WHERE url = ? AND cached_at > ?;",
+            (url, time() - self.ttl)).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return {"title": row[0], "tags": json.loads(row[1])}
+
+    def set(self, url: str, title: str, tags: list[str]) -> None:
+        """
+        Stores the title and tags scraped from the page at the url.
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO page(url, title, tags, cached_at) VALUES (?, ?, ?, ?);",
+            (url, title, json.dumps(tags), time()))
+        self.connection.commit()
+
+    def evict(self) -> None:
+        """
+        Removes expired entries, then the oldest entries until the cache
+        is back within its size limit.
+        """
+        self.connection.execute(
+            "DELETE FROM page WHERE cached_at <= ?;", (time() - self.ttl,))
+        self.connection.execute("""
+            DELETE FROM page WHERE url IN (
+                SELECT url FROM page ORDER BY cached_at DESC LIMIT -1 OFFSET ?
+            );""", (self.max_entries,))
+        self.connection.commit()
+
+    def close(self) -> None:
+        """
+        Closes the connection to the cache file.
+        """
+        self.connection.close()
+
+
+class TagCache:
+    """
+    A cache of cleaned tags keyed by the raw tag. An empty list means the tag was dropped.
+    The most recently used tags are kept in memory, up to max_size of them, and when a path
+    is given every tag is also stored in a SQLite file so it survives between runs.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_size: int = TAG_CACHE_SIZE) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.memory = OrderedDict()
+        self.connection = None
+        if path is not None:
+            self.connection = sqlite3.connect(path)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS tag(
+                    raw_tag TEXT PRIMARY KEY,
+                    cleaned_tags TEXT NOT NULL
+                );""")
+            self.connection.commit()
+
+    def remember(self, tag: str, cleaned: list[str]) -> None:
+        """
+        Keeps the cleaned tags in memory, forgetting the least recently used tag if full.
+        """
+        self.memory[tag] = cleaned
+        self.memory.move_to_end(tag)
+        if len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def get(self, tag: str) -> Optional[list[str]]:
+        """
+        Returns the cleaned tags for the raw tag, or None if it has never been cleaned.
+        """
+        if tag in self.memory:
+            self.hits += 1
+            self.memory.move_to_end(tag)
+            return self.memory[tag]
+
+        if self.connection is not None:
+            row = self.connection.execute(
+                "SELECT cleaned_tags FROM tag WHERE raw_tag = ?;", (tag,)).fetchone()
+            if row is not None:
+                self.hits += 1
+                cleaned = json.loads(row[0])
+                self.remember(tag, cleaned)
+                return cleaned
+
+        self.misses += 1
+        return None
+
+    def set(self, tag: str, cleaned: list[str]) -> None:
+        """
+        Stores the cleaned tags for the raw tag.
+        """
+        self.remember(tag, cleaned)
+        if self.connection is not None:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO tag(raw_tag, cleaned_tags) VALUES (?, ?);",
+                (tag, json.dumps(cleaned)))
+            self.connection.commit()
+
+    def close(self) -> None:
+        """
+        Closes the connection to the cache file, if there is one.
+        """
+        if self.connection is not None:
+            self.connection.close()
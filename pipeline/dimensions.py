@@ -0,0 +1,97 @@
+"""
+Script which keeps the ids of the rows in the dimension and lookup tables in memory,
+so the loader doesn't have to read whole tables from the database on every run.
+"""
+
+import json
+import os
+from typing import Optional
+
+from psycopg2 import extensions, sql
+
+# Bumped whenever the keys or ids in a snapshot change meaning, so older snapshots are discarded
+SNAPSHOT_VERSION = 2
+
+DIMENSIONS = {
+    "genre": ("genre_id", ("genre",)),
+    "artist": ("artist_id", ("artist_name",)),
+    "country": ("country_id", ("country",)),
+    "item": ("item_id", ("item_name", "artist_id", "item_type_id")),
+    "item_type": ("item_type_id", ("item_type",)),
+}
+
+
+class DimensionCache:
+    """
+    A dictionary of ids for each dimension table, keyed by the natural key of each row:
+    its name, or for items a tuple of (item_name, artist_id, item_type_id).
+    Only rows newer than the last one seen are read from the database on refresh,
+    and rows inserted by the loader are added from their RETURNING clause.
+    When a path is given, a snapshot of the ids is kept in that file between runs.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self.ids = {table: {} for table in DIMENSIONS}
+        self.last_seen_ids = {table: 0 for table in DIMENSIONS}
+        if path is not None and os.path.exists(path):
+            self.load_snapshot()
+
+    def refresh(self, db_connection: extensions.connection) -> None:
+        """
+        Reads the rows added to each dimension table since the last refresh.
+        """
+        with db_connection.cursor() as cur:
+            for table, (id_column, key_columns) in DIMENSIONS.items():
+                cur.execute(sql.SQL("""
+                    SELECT {id_column}, {key_columns} FROM {table}
+                    WHERE {id_column} > %s
+                    ORDER BY {id_column};""").format(
+                    id_column=sql.Identifier(id_column),
+                    key_columns=sql.SQL(", ").join(map(sql.Identifier, key_columns)),
+                    table=sql.Identifier(table)),
+                    (self.last_seen_ids[table],))
+
+                rows = cur.fetchall()
+                self.ids[table].update(
+                    {row[1] if len(key_columns) == 1 else row[1:]: row[0] for row in rows})
+                if rows:
+                    self.last_seen_ids[table] = rows[-1][0]
+
+    def add(self, table: str, ids: dict) -> None:
+        """
+        Adds the ids of rows just inserted into a dimension table.
+        """
+        self.ids[table].update(ids)
+
+    def load_snapshot(self) -> None:
+        """
+        Reads the ids saved in the snapshot file. A snapshot saved in another format
+        is ignored, so every id is read from the database on the next refresh.
+        """
+        with open(self.path, encoding="utf_8") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            print("Ignoring dimension snapshot saved in an older format.")
+            return
+
+        for table in DIMENSIONS:
+            self.ids[table] = {tuple(key) if isinstance(key, list) else key: row_id
+                               for key, row_id in snapshot["ids"].get(table, [])}
+            self.last_seen_ids[table] = snapshot["last_seen_ids"].get(table, 0)
+
+    def save_snapshot(self) -> None:
+        """
+        Saves the ids to the snapshot file, if there is one.
+        """
+        if self.path is None:
+            return
+
+        snapshot = {"version": SNAPSHOT_VERSION,
+                    "ids": {table: list(ids.items()) for table, ids in self.ids.items()},
+                    "last_seen_ids": self.last_seen_ids}
+
+        with open(f"{self.path}.tmp", "w", encoding="utf_8") as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.replace(f"{self.path}.tmp", self.path)
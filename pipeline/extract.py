@@ -2,18 +2,70 @@
 Script to interact with the Bandcamp API and extract relevant information
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from urllib.request import urlopen
+from hashlib import sha1
+from threading import Lock
+from typing import Optional
 
-from bs4 import BeautifulSoup
+from lxml import etree, html as lxml_html
 import requests
-from requests.exceptions import Timeout, HTTPError
+from requests.adapters import HTTPAdapter
+from requests.exceptions import Timeout, HTTPError, RequestException
+from urllib3.util.retry import Retry
+
+from cache import PageCache
 
 EPOCH = datetime.utcfromtimestamp(0)
 TIMEOUT = 20
 ALBUM = "a"
 TRACK = "t"
 FIVE_MINS_IN_SECONDS = 300
+MAX_WORKERS = 8
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+BACKOFF_JITTER = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+SESSION = None
+SESSION_LOCK = Lock()
+TITLE_XPATH = "//h2[contains(concat(' ', normalize-space(@class), ' '), ' trackTitle ')]"
+TAG_XPATH = "//a[contains(concat(' ', normalize-space(@class), ' '), ' tag ')]"
+
+
+def create_session(pool_size: int = MAX_WORKERS) -> requests.Session:
+    """
+    Returns a session that keeps connections to each host alive and reuses them,
+    holding at most pool_size connections per host. Failed requests are retried
+    with an exponential, jittered backoff.
+    """
+    retry = Retry(total=RETRIES,
+                  backoff_factor=BACKOFF_FACTOR,
+                  backoff_jitter=BACKOFF_JITTER,
+                  status_forcelist=RETRY_STATUSES,
+                  allowed_methods=frozenset(["GET"]))
+    adapter = HTTPAdapter(pool_maxsize=pool_size,
+                          pool_block=True,
+                          max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
+def get_session(pool_size: int = MAX_WORKERS) -> requests.Session:
+    """
+    Returns the session shared by every request to Bandcamp, creating it on first use
+    with pool_size connections per host. Call it with the number of scraping threads
+    before the first request, so each thread has a connection.
+    """
+    global SESSION  # pylint: disable=global-statement
+
+    with SESSION_LOCK:
+        if SESSION is None:
+            SESSION = create_session(pool_size)
+        return SESSION
 
 
 def unix_time_seconds(dt: datetime) -> int:
@@ -37,14 +89,19 @@ def get_minute_rounded_down(dt: datetime) -> datetime:
     return dt.replace(second=0, microsecond=0)
 
 
-def load_sales_data(dt: datetime) -> dict:
+def load_sales_data(dt: datetime, watermark: Optional[float] = None) -> dict:
     """
-    Uses the bandcamp API to return all the sales data from the last 5 minute in json format.
+    Uses the bandcamp API to return all the sales data since the watermark
+    (the utc_date of the last sale processed) in json format.
+    Without a watermark, the sales data from the last 5 minutes is returned.
     """
-    minute = get_minute_rounded_down(dt)
-    seconds = unix_time_seconds(minute) - FIVE_MINS_IN_SECONDS
+    if watermark is None:
+        minute = get_minute_rounded_down(dt)
+        seconds = unix_time_seconds(minute) - FIVE_MINS_IN_SECONDS
+    else:
+        seconds = int(watermark)
     try:
-        response = requests.get(
+        response = get_session().get(
             f"https://bandcamp.com/api/salesfeed/1/get?start_date={seconds}", timeout=TIMEOUT)
     except ConnectionError as exc:
         raise ConnectionError("Connection failed") from exc
@@ -56,53 +113,130 @@ def load_sales_data(dt: datetime) -> dict:
     return response.json()
 
 
+def get_latest_utc_date(sales_json: dict) -> Optional[float]:
+    """
+    Given the JSON response from the Bandcamp API, returns the utc_date
+    of the most recent item in it, or None if there are no items.
+    """
+    dates = [item["utc_date"]
+             for event in sales_json["events"] for item in event.get("items", [])]
+    return max(dates, default=None)
+
+
+def get_sale_key(item: dict) -> str:
+    """
+    Given an item from the Bandcamp API, returns a key that identifies that sale,
+    so the same sale is never loaded twice.
+    """
+    sale = f"{item['utc_date']}|{item['url']}|{item['country']}|" \
+        f"{item['amount_paid_usd']}|{item['artist_name']}"
+    return sha1(sale.encode("utf_8")).hexdigest()
+
+
 def get_html(url: str) -> str:
     """
     Given a url for a track, returns the associated html for that page.
     """
-    with urlopen(url) as page:
-        html_bytes = page.read()
-        html_doc = html_bytes.decode("utf_8")
-        return html_doc
+    response = get_session().get(url, timeout=TIMEOUT)
+    response.raise_for_status()
+    return response.content.decode("utf_8")
+
+
+def get_html_or_none(url: str) -> Optional[str]:
+    """
+    Given a url for a track, returns the associated html for that page,
+    or None if the page couldn't be fetched, such as a deleted release,
+    or isn't encoded in UTF-8.
+    """
+    try:
+        return get_html(url)
+    except (RequestException, UnicodeDecodeError) as exc:
+        print(f"Skipping {url}: {exc}")
+        return None
 
 
-def get_tags_from_url(html: str) -> list[str]:
+def get_data_from_html(html: str) -> dict:
     """
-    Given the track page html, returns the associated tags for that track.
+    Given the track page html, parses it once and returns
+    the title and associated tags for the track / album.
     """
-    tags = []
+    document = lxml_html.document_fromstring(html)
+
+    title = document.xpath(TITLE_XPATH)[0].text_content()
+    tags = [tag.text_content() for tag in document.xpath(TAG_XPATH)]
+
+    return {"title": title, "tags": tags}
 
-    soup = BeautifulSoup(html, "lxml")
 
-    for tag in soup.find_all("a", {"class": "tag"}):
-        tags.append(tag.text)
+def get_html_for_urls(urls: list[str], max_workers: int = MAX_WORKERS) -> list[Optional[str]]:
+    """
+    Given a list of urls, fetches the html for each page concurrently
+    and returns them in the same order as the urls, with None for pages that failed.
+    """
+    if not urls:
+        return []
 
-    return tags
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as executor:
+        return list(executor.map(get_html_or_none, urls))
 
 
-def get_title_from_url(html: str) -> str:
+def get_page_metadata(urls: list[str], max_workers: int = MAX_WORKERS,
+                      page_cache: Optional[PageCache] = None) -> list[Optional[dict]]:
     """
-    Given the track page html, returns the associated title for the track / album
+    Given a list of item urls, returns the title and tags for each page in the same order,
+    or None for pages that couldn't be fetched or have no title.
+    Each unique url is resolved once, even if it was sold several times in the batch.
+    Pages found in the cache are not requested again; the rest are scraped concurrently
+    and added to the cache.
     """
+    metadata = {}
+    missing = []
 
-    soup = BeautifulSoup(html, "lxml")
-    title = soup.find("h2", {"class": "trackTitle"})
+    for url in dict.fromkeys(urls):
+        cached = page_cache.get(url) if page_cache is not None else None
+        if cached is None:
+            missing.append(url)
+        else:
+            metadata[url] = cached
 
-    return title.text
+    pages = get_html_for_urls(missing, max_workers)
 
+    for url, html in zip(missing, pages):
+        if html is None:
+            continue
+        try:
+            metadata[url] = get_data_from_html(html)
+        except (IndexError, etree.ParserError):
+            print(f"Skipping {url}: the page is empty or has no title")
+            continue
+        if page_cache is not None:
+            page_cache.set(url, **metadata[url])
 
-def extract_data_from_json(sales_json: dict) -> list[dict]:
+    return [metadata.get(url) for url in urls]
+
+
+def extract_data_from_json(sales_json: dict, max_workers: int = MAX_WORKERS,
+                           page_cache: Optional[PageCache] = None,
+                           watermark: Optional[float] = None) -> list[dict]:
     """
     Given the JSON response from a get request to the Bandcamp API,
-    return a list of dicts with wanted information for each sale.
+    return a list of dicts with wanted information for each sale
+    made after the watermark.
+    Item pages are fetched concurrently, using at most max_workers threads,
+    unless they are already in the page cache. Sales whose page couldn't be scraped
+    are dropped, so one bad page doesn't stop the rest of the batch from loading.
     """
-    data = []
+    sales = []
 
     events = sales_json["events"]
     for event in events:
         if event["event_type"] == "sale":
             items = event["items"]
             for item in items:
+                # skip sales that were processed by a previous run
+                if watermark is not None and item["utc_date"] <= watermark:
+                    continue
+
                 # determine item type. Skip if not an album or track
                 item_type = item["item_type"]
                 if item_type not in (ALBUM, TRACK):
@@ -117,21 +251,30 @@ def extract_data_from_json(sales_json: dict) -> list[dict]:
                 if "https:" not in url:
                     url = "https:" + url
 
-                html = get_html(url)
-                tags = get_tags_from_url(html)
-                title = get_title_from_url(html)
-                time_bought = get_datetime_from_unix(item["utc_date"])
-
-                entry = {
-                    "amount_paid_usd": item["amount_paid_usd"],
-                    "tags": tags,
-                    "country": item["country"],
-                    "title": title,
-                    "artist": item["artist_name"],
-                    "at": time_bought,
-                    "type": item_type,
-                    "image": item["art_url"]
-                }
-                data.append(entry)
+                sales.append((item, item_type, url))
+
+    metadata = get_page_metadata(
+        [url for _, _, url in sales], max_workers, page_cache)
+
+    data = []
+    for (item, item_type, _), page in zip(sales, metadata):
+        if page is None:
+            continue
+        tags = page["tags"]
+        title = page["title"]
+        time_bought = get_datetime_from_unix(item["utc_date"])
+
+        entry = {
+            "amount_paid_usd": item["amount_paid_usd"],
+            "tags": tags,
+            "country": item["country"],
+            "title": title,
+            "artist": item["artist_name"],
+            "at": time_bought,
+            "type": item_type,
+            "image": item["art_url"],
+            "sale_key": get_sale_key(item)
+        }
+        data.append(entry)
 
     return data
@@ -1,10 +1,15 @@
 "Script which loads the data into the database"
 
 from os import environ
+from typing import Optional
 
 from psycopg2 import extensions, connect
+from psycopg2.extras import execute_values
 import pandas as pd
 
+from dimensions import DimensionCache
+from rollups import get_rollup_query
+
 GENRES_NOT_IN_DB = set()
 
 ARTISTS_NOT_IN_DB = set()
@@ -13,7 +18,23 @@ COUNTRIES_NOT_IN_DB = set()
 
 ITEMS_NOT_IN_DB = set()
 
-TAGS_NOT_IN_DB = []
+ITEM_GENRES_NOT_IN_DB = set()
+
+SALESFEED_WATERMARK = "salesfeed"
+
+PARTITION_MONTHS_AHEAD = 2
+
+
+def reset_load_state() -> None:
+    """
+    Empties the rows waiting to be inserted, so nothing from a previous batch
+    is inserted again when the pipeline runs more than once in the same process.
+    """
+    GENRES_NOT_IN_DB.clear()
+    ARTISTS_NOT_IN_DB.clear()
+    COUNTRIES_NOT_IN_DB.clear()
+    ITEMS_NOT_IN_DB.clear()
+    ITEM_GENRES_NOT_IN_DB.clear()
 
 
 def get_db_connection() -> extensions.connection:
@@ -31,47 +52,40 @@ def get_db_connection() -> extensions.connection:
         print("Error: Cannot connect to the database")
 
 
-def get_genres(db_connection: extensions.connection) -> dict:
+def get_watermark(db_connection: extensions.connection) -> Optional[float]:
     """
-    Returns a dictionary of all the current genres in the database.
+    Returns the utc_date of the last sale processed from the salesfeed,
+    or None if the pipeline has never run.
     """
     with db_connection.cursor() as cur:
-        cur.execute("SELECT * FROM genre;")
-        genres = cur.fetchall()
-        return {r[1]: r[0] for r in genres}
+        cur.execute("SELECT last_utc_date FROM watermark WHERE watermark_name = %s;",
+                    (SALESFEED_WATERMARK,))
+        watermark = cur.fetchone()
+        return watermark[0] if watermark else None
 
 
-def get_artists(db_connection: extensions.connection) -> dict:
+def update_watermark(db_connection: extensions.connection, utc_date: float) -> None:
     """
-    Returns a dictionary of all the current artists in the database.
+    Moves the salesfeed watermark forward to the given utc_date.
     """
     with db_connection.cursor() as cur:
-        cur.execute("SELECT * FROM artist;")
-
-        artists = cur.fetchall()
-        return {r[1]: r[0] for r in artists}
-
-
-def get_countries(db_connection: extensions.connection) -> dict:
-    """
-    Returns a dictionary of all the current countries in the database.
-    """
-    with db_connection.cursor() as cur:
-        cur.execute("SELECT * FROM country;")
-
-        countries = cur.fetchall()
-        return {r[1]: r[0] for r in countries}
+        cur.execute("""
+            INSERT INTO watermark(watermark_name, last_utc_date) VALUES (%s, %s)
+            ON CONFLICT (watermark_name) DO UPDATE
+            SET last_utc_date = GREATEST(watermark.last_utc_date, EXCLUDED.last_utc_date);
+            """, (SALESFEED_WATERMARK, utc_date))
+        db_connection.commit()
 
 
-def get_items(db_connection: extensions.connection) -> dict:
+def create_partitions(db_connection: extensions.connection,
+                      months_ahead: int = PARTITION_MONTHS_AHEAD) -> None:
     """
-    Returns a dictionary of all the current items in the database.
+    Creates the monthly sale_event partitions from this month to months_ahead months
+    ahead, if they don't exist yet, so new sales never land in the default partition.
     """
     with db_connection.cursor() as cur:
-        cur.execute("SELECT * FROM item;")
-
-        items = cur.fetchall()
-        return {r[2]: r[0] for r in items}
+        cur.execute("SELECT create_sale_event_partitions(CURRENT_DATE, %s);", (months_ahead,))
+    db_connection.commit()
 
 
 def check_if_genre_in_db(new_genre: str, genres: dict) -> None:
@@ -79,7 +93,6 @@ def check_if_genre_in_db(new_genre: str, genres: dict) -> None:
     Checks if the new genre is in the database and appends it to a list.
     """
     if new_genre.lower() not in genres.keys():
-        new_genre = new_genre.replace("'", "`")
         GENRES_NOT_IN_DB.add((new_genre.lower(),))
 
 
@@ -88,7 +101,6 @@ def check_if_artist_in_db(new_artist: str, artists: dict) -> None:
     Checks if the new artist is in the database and appends it to a list.
     """
     if new_artist.lower() not in artists.keys():
-        new_artist = new_artist.replace("'", "`")
         ARTISTS_NOT_IN_DB.add((new_artist.lower(),))
 
 
@@ -97,163 +109,191 @@ def check_if_country_in_db(new_country: str, countries: dict) -> None:
     Checks if the new country is in the database and appends it to a list.
     """
     if new_country not in countries.keys():
-        new_country = new_country.replace("'", "`")
         COUNTRIES_NOT_IN_DB.add((new_country,))
 
 
-def check_if_item_in_db(new_item: str, items: dict, db_connection: extensions.connection) -> None:
+def get_item_key(new_item: pd.Series, item_types: dict, artists: dict) -> tuple:
     """
-    Checks if the new item is in the database and retrieves 
-    all the data about the item to append it to a set.
+    Returns the natural key of an item: its title, artist id and item type id.
+    The ids of the item type and artist are looked up in the given dictionaries.
     """
-    new_item['title'] = new_item['title'].replace("'", "`")
-    new_item['artist'] = new_item['artist'].replace("'", "`")
-    if new_item['title'] not in items.keys():
-        with db_connection.cursor() as cur:
-            cur.execute(
-                f"SELECT item_type_id FROM item_type WHERE item_type='{new_item['type']}'")
-            item_type_id = cur.fetchone()[0]
-            cur.execute(f"""SELECT artist_id FROM artist
-                        WHERE artist_name='{new_item['artist'].lower()}'""")
-            artist_id = cur.fetchone()[0]
-            ITEMS_NOT_IN_DB.add(
-                (new_item['title'], artist_id, item_type_id, new_item['image']))
-            TAGS_NOT_IN_DB.append(new_item['tags'])
+    return (new_item['title'],
+            artists[new_item['artist'].lower()],
+            item_types[new_item['type']])
 
 
-def add_genres_to_database(db_connection: extensions.connection, list: list[str]) -> None:
+def check_if_item_in_db(new_item: pd.Series, items: dict, item_types: dict, artists: dict) -> None:
+    """
+    Checks if the new item is in the database and appends all the data about the item,
+    and the genre it is tagged with, to a set.
     """
-    Adds any new genres into the database.
+    item_key = get_item_key(new_item, item_types, artists)
+    if item_key not in items.keys():
+        ITEMS_NOT_IN_DB.add((*item_key, new_item['image']))
+        ITEM_GENRES_NOT_IN_DB.add((item_key, new_item['tags'].lower()))
+
+
+def add_genres_to_database(db_connection: extensions.connection, list: list[str]) -> dict:
+    """
+    Adds any new genres into the database and returns a dictionary of their ids,
+    including the ids of any that another load had already added.
     """
     with db_connection.cursor() as cur:
-        query = f"""
-            INSERT INTO genre(genre) VALUES (%s) ON CONFLICT DO NOTHING;
+        query = """
+            INSERT INTO genre(genre) VALUES %s
+            ON CONFLICT (genre) DO UPDATE SET genre = EXCLUDED.genre
+            RETURNING genre, genre_id;
             """
 
-        cur.executemany(query, list)
+        genres = execute_values(cur, query, list, fetch=True)
         db_connection.commit()
-        print(f"Genres added!")
+        print("Genres added!")
+        return dict(genres)
 
 
-def add_artists_to_database(db_connection: extensions.connection, list: list[str]) -> None:
+def add_artists_to_database(db_connection: extensions.connection, list: list[str]) -> dict:
     """
-    Adds any new artists into the database.
+    Adds any new artists into the database and returns a dictionary of their ids,
+    including the ids of any that another load had already added.
     """
 
     with db_connection.cursor() as cur:
-        query = f"""
-            INSERT INTO artist(artist_name) VALUES (%s) ON CONFLICT DO NOTHING;
+        query = """
+            INSERT INTO artist(artist_name) VALUES %s
+            ON CONFLICT (artist_name) DO UPDATE SET artist_name = EXCLUDED.artist_name
+            RETURNING artist_name, artist_id;
             """
 
-        cur.executemany(query, list)
+        artists = execute_values(cur, query, list, fetch=True)
         db_connection.commit()
         print("Artists added!")
+        return dict(artists)
 
 
-def add_countries_to_database(db_connection: extensions.connection, list: list[str]) -> None:
+def add_countries_to_database(db_connection: extensions.connection, list: list[str]) -> dict:
     """
-    Adds any new countries into the database.
+    Adds any new countries into the database and returns a dictionary of their ids,
+    including the ids of any that another load had already added.
     """
     with db_connection.cursor() as cur:
-        query = f"""
-            INSERT INTO country(country) VALUES (%s) ON CONFLICT DO NOTHING;
+        query = """
+            INSERT INTO country(country) VALUES %s
+            ON CONFLICT (country) DO UPDATE SET country = EXCLUDED.country
+            RETURNING country, country_id;
             """
 
-        cur.executemany(query, list)
+        countries = execute_values(cur, query, list, fetch=True)
         db_connection.commit()
         print("Countries added!")
+        return dict(countries)
 
 
-def add_items_to_database(db_connection: extensions.connection, list: list[tuple]) -> None:
+def add_items_to_database(db_connection: extensions.connection, list: list[tuple]) -> dict:
     """
-    Adds any new items into the database.
+    Adds any new items into the database and returns a dictionary of their ids,
+    keyed by (item_name, artist_id, item_type_id), including the ids of any
+    that another load had already added.
     """
     with db_connection.cursor() as cur:
-        query = f"""
+        query = """
             INSERT INTO item(item_name, artist_id, item_type_id, item_image)
-            VALUES (%s, %s, %s, %s);
+            VALUES %s
+            ON CONFLICT (artist_id, item_name, item_type_id) DO UPDATE
+            SET item_name = EXCLUDED.item_name
+            RETURNING item_name, artist_id, item_type_id, item_id;
         """
 
-        cur.executemany(query, list)
+        # an upsert can't touch the same row twice, so keep one image per item
+        new_items = {item[:3]: item for item in list}.values()
+        items = execute_values(cur, query, new_items, fetch=True)
         db_connection.commit()
         print("Items added!")
+        return {tuple(item[:3]): item[3] for item in items}
 
 
-def add_item_genres_to_database(db_connection: extensions.connection, list: list[tuple], tags: list[tuple]) -> None:
+def add_item_genres_to_database(db_connection: extensions.connection, list: list[tuple],
+                                items: dict, genres: dict) -> None:
     """
     Adds all the item genre connections for all the new items.
+    Each connection is a pair of item key and genre, whose ids are looked up
+    in the given dictionaries.
     """
-    count = 0
-    item_genres = []
-    with db_connection.cursor() as cur:
-        for item in list:
-            cur.execute(
-                f"SELECT item_id FROM item WHERE item_name = '{item[0]}'")
-            item_id = cur.fetchone()[0]
-
-            tags[count] = tags[count].replace("'", "`")
-            cur.execute(
-                f"SELECT genre_id FROM genre WHERE genre = '{tags[count].lower()}'")
-            genre_id = cur.fetchone()[0]
+    item_genres = {(items[item_key], genres[genre]) for item_key, genre in list}
 
-            item_genres.append((item_id, genre_id))
-
-            count += 1
-
-        query = f"""
-            INSERT INTO item_genre (item_id, genre_id) VALUES (%s, %s);
+    with db_connection.cursor() as cur:
+        query = """
+            INSERT INTO item_genre (item_id, genre_id) VALUES %s;
             """
 
-        cur.executemany(query, item_genres)
+        execute_values(cur, query, item_genres, page_size=max(len(item_genres), 1))
         db_connection.commit()
         print("Added Item Genres!")
 
 
-def add_sales_events(new_sale: pd.Series, db_connection: extensions.connection) -> None:
+def add_sales_events(db_connection: extensions.connection, sales: pd.DataFrame,
+                     countries: dict, items: dict, item_types: dict, artists: dict) -> None:
     """
-    Adds all the new sales events to the database.
+    Adds all the new sales events to the database, and to the rollups, in a single transaction.
+    The country and item of each sale are looked up in the given dictionaries of ids.
     """
+    sale_events = [(sale['at'],
+                    int(sale['amount_paid_usd']),
+                    countries[sale['country']],
+                    items[get_item_key(sale, item_types, artists)],
+                    sale['sale_key'])
+                   for sale in sales.to_dict('records')]
+
     with db_connection.cursor() as cur:
-        cur.execute(
-            f"SELECT country_id FROM country WHERE country='{new_sale['country']}';")
-        country_id = cur.fetchone()[0]
-
-        new_sale['title'] = new_sale['title'].replace("'", "`")
-        cur.execute(
-            f"SELECT item_id FROM item WHERE item_name='{new_sale['title']}'")
-        item_id = cur.fetchone()[0]
-
-        cur.execute(f"""INSERT INTO sale_event(sale_time, amount, country_id, item_id)
-                    VALUES ('{new_sale['at']}', {new_sale['amount_paid_usd']}, 
-                    {country_id}, {item_id}) """)
+        query = get_rollup_query("""
+            INSERT INTO sale_event(sale_time, amount, country_id, item_id, sale_key)
+            VALUES %s ON CONFLICT DO NOTHING
+            """)
+
+        execute_values(cur, query, sale_events, page_size=max(len(sale_events), 1))
         db_connection.commit()
 
 
-def load(db_connection: extensions.connection, flat_dataframe: pd.DataFrame, not_flat_dataframe: pd.DataFrame) -> None:
+def load(db_connection: extensions.connection, flat_dataframe: pd.DataFrame,
+         not_flat_dataframe: pd.DataFrame, dimensions: Optional[DimensionCache] = None) -> None:
     """
     Takes the dataframes of all the new sales data and loads it into the database.
+    The ids of existing genres, artists, countries and items are looked up in the
+    dimension cache, which only reads the rows added since it was last refreshed.
     """
-    db_genres = get_genres(db_connection)
-    db_artists = get_artists(db_connection)
-    db_countries = get_countries(db_connection)
-    db_items = get_items(db_connection)
+    reset_load_state()
+
+    if dimensions is None:
+        dimensions = DimensionCache()
+    dimensions.refresh(db_connection)
+    db_genres = dimensions.ids["genre"]
+    db_artists = dimensions.ids["artist"]
+    db_countries = dimensions.ids["country"]
+    db_items = dimensions.ids["item"]
 
     flat_dataframe['tags'].apply(check_if_genre_in_db, genres=db_genres)
-    add_genres_to_database(db_connection, GENRES_NOT_IN_DB)
+    dimensions.add("genre", add_genres_to_database(
+        db_connection, GENRES_NOT_IN_DB))
 
     flat_dataframe['artist'].apply(check_if_artist_in_db, artists=db_artists)
-    add_artists_to_database(db_connection, ARTISTS_NOT_IN_DB)
+    dimensions.add("artist", add_artists_to_database(
+        db_connection, ARTISTS_NOT_IN_DB))
 
     flat_dataframe['country'].apply(
         check_if_country_in_db, countries=db_countries)
-    add_countries_to_database(db_connection, COUNTRIES_NOT_IN_DB)
+    dimensions.add("country", add_countries_to_database(
+        db_connection, COUNTRIES_NOT_IN_DB))
 
     flat_dataframe.apply(check_if_item_in_db, items=db_items,
-                         db_connection=db_connection, axis=1)
-    add_items_to_database(db_connection, ITEMS_NOT_IN_DB)
+                         item_types=dimensions.ids["item_type"],
+                         artists=db_artists, axis=1)
+    dimensions.add("item", add_items_to_database(
+        db_connection, ITEMS_NOT_IN_DB))
 
-    add_item_genres_to_database(db_connection, ITEMS_NOT_IN_DB, TAGS_NOT_IN_DB)
+    add_item_genres_to_database(
+        db_connection, ITEM_GENRES_NOT_IN_DB, db_items, db_genres)
 
-    not_flat_dataframe.apply(
-        add_sales_events, db_connection=db_connection, axis=1)
+    add_sales_events(db_connection, not_flat_dataframe, db_countries, db_items,
+                     dimensions.ids["item_type"], db_artists)
     print("Sales Added!")
+
+    dimensions.save_snapshot()
@@ -0,0 +1,17 @@
+-- Adds the natural sale key used to skip duplicate sales
+-- and the watermark table used for incremental salesfeed ingestion.
+
+BEGIN;
+
+ALTER TABLE sale_event ADD COLUMN sale_key VARCHAR;
+UPDATE sale_event SET sale_key = 'legacy-' || sale_id;
+ALTER TABLE sale_event ALTER COLUMN sale_key SET NOT NULL;
+ALTER TABLE sale_event ADD CONSTRAINT sale_event_sale_key_key UNIQUE (sale_key);
+
+CREATE TABLE IF NOT EXISTS watermark(
+    watermark_name VARCHAR NOT NULL,
+    last_utc_date DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (watermark_name)
+);
+
+COMMIT;
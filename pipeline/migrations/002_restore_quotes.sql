@@ -0,0 +1,23 @@
+-- The loader used to store apostrophes as backticks so they could be put into SQL strings.
+-- It now uses bound parameters, so this puts the apostrophes back in existing rows.
+-- Delete the DIMENSION_CACHE_PATH snapshot afterwards, as it holds the old names.
+
+BEGIN;
+
+UPDATE genre SET genre = replace(genre, '`', '''')
+WHERE genre LIKE '%`%'
+AND NOT EXISTS (SELECT 1 FROM genre AS g WHERE g.genre = replace(genre.genre, '`', ''''));
+
+UPDATE artist SET artist_name = replace(artist_name, '`', '''')
+WHERE artist_name LIKE '%`%'
+AND NOT EXISTS (SELECT 1 FROM artist AS a
+                WHERE a.artist_name = replace(artist.artist_name, '`', ''''));
+
+UPDATE country SET country = replace(country, '`', '''')
+WHERE country LIKE '%`%'
+AND NOT EXISTS (SELECT 1 FROM country AS c WHERE c.country = replace(country.country, '`', ''''));
+
+UPDATE item SET item_name = replace(item_name, '`', '''')
+WHERE item_name LIKE '%`%';
+
+COMMIT;
@@ -0,0 +1,33 @@
+-- Items used to be looked up by their title alone, so two artists' items with the same
+-- title were merged into one. This merges any exact duplicates of an item into the copy
+-- with the lowest id, then adds a unique index on the natural key of an item, which the
+-- loaders use for their lookups and upserts.
+-- Delete the DIMENSION_CACHE_PATH snapshot afterwards, as it holds items by title alone.
+
+BEGIN;
+
+CREATE TEMP TABLE duplicate_item ON COMMIT DROP AS
+SELECT item_id, MIN(item_id) OVER (PARTITION BY artist_id, item_name, item_type_id) AS kept_item_id
+FROM item;
+
+DELETE FROM duplicate_item WHERE item_id = kept_item_id;
+
+UPDATE sale_event SET item_id = duplicate_item.kept_item_id
+FROM duplicate_item
+WHERE sale_event.item_id = duplicate_item.item_id;
+
+INSERT INTO item_genre(item_id, genre_id)
+SELECT DISTINCT duplicate_item.kept_item_id, item_genre.genre_id
+FROM item_genre
+JOIN duplicate_item
+ON duplicate_item.item_id = item_genre.item_id
+WHERE NOT EXISTS (SELECT 1 FROM item_genre AS kept
+                  WHERE kept.item_id = duplicate_item.kept_item_id
+                  AND kept.genre_id = item_genre.genre_id);
+
+DELETE FROM item WHERE item_id IN (SELECT item_id FROM duplicate_item);
+
+ALTER TABLE item ADD CONSTRAINT item_artist_id_item_name_item_type_id_key
+UNIQUE (artist_id, item_name, item_type_id);
+
+COMMIT;
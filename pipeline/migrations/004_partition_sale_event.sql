@@ -0,0 +1,82 @@
+-- Turns sale_event into a table partitioned by month on sale_time, so queries over a
+-- time window only scan the partitions in that window, and adds indexes on sale_time,
+-- item_id and country_id. Partitions are created for every month with sales up to two
+-- months ahead, and the pipeline creates future partitions as it goes.
+
+BEGIN;
+
+ALTER TABLE sale_event RENAME TO sale_event_unpartitioned;
+ALTER TABLE sale_event_unpartitioned RENAME CONSTRAINT sale_event_pkey
+    TO sale_event_unpartitioned_pkey;
+ALTER TABLE sale_event_unpartitioned RENAME CONSTRAINT sale_event_sale_key_key
+    TO sale_event_unpartitioned_sale_key_key;
+
+CREATE TABLE sale_event(
+    sale_id BIGINT GENERATED ALWAYS AS IDENTITY,
+    sale_time TIMESTAMPTZ NOT NULL,
+    amount INT NOT NULL,
+    item_id INT NOT NULL,
+    country_id SMALLINT NOT NULL,
+    sale_key VARCHAR NOT NULL,
+    PRIMARY KEY (sale_id, sale_time),
+    UNIQUE (sale_key, sale_time),
+    FOREIGN KEY (item_id) REFERENCES item(item_id),
+    FOREIGN KEY (country_id) REFERENCES country(country_id)
+) PARTITION BY RANGE (sale_time);
+
+CREATE TABLE sale_event_default PARTITION OF sale_event DEFAULT;
+
+CREATE INDEX sale_event_sale_time_idx ON sale_event(sale_time);
+CREATE INDEX sale_event_item_id_idx ON sale_event(item_id);
+CREATE INDEX sale_event_country_id_idx ON sale_event(country_id);
+
+-- Creates the monthly partitions of sale_event from the month of start_date
+-- to months_ahead months later, moving any of their sales out of the default partition.
+CREATE OR REPLACE FUNCTION create_sale_event_partitions(start_date DATE, months_ahead INT)
+RETURNS VOID AS $$
+DECLARE
+    month_start TIMESTAMP;
+    partition_name TEXT;
+BEGIN
+    FOR month_number IN 0..months_ahead LOOP
+        month_start := date_trunc('month', start_date) + make_interval(months => month_number);
+        partition_name := 'sale_event_' || to_char(month_start, 'YYYY_MM');
+
+        CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+
+        EXECUTE format('CREATE TABLE %I (LIKE sale_event INCLUDING DEFAULTS)', partition_name);
+        EXECUTE format('
+            WITH moved AS (
+                DELETE FROM sale_event_default WHERE sale_time >= %L AND sale_time < %L
+                RETURNING *
+            )
+            INSERT INTO %I SELECT * FROM moved',
+            month_start AT TIME ZONE 'UTC',
+            (month_start + INTERVAL '1 month') AT TIME ZONE 'UTC',
+            partition_name);
+        EXECUTE format('ALTER TABLE sale_event ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+            partition_name,
+            month_start AT TIME ZONE 'UTC',
+            (month_start + INTERVAL '1 month') AT TIME ZONE 'UTC');
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT create_sale_event_partitions(month::DATE, 0)
+FROM generate_series(
+    date_trunc('month', COALESCE((SELECT MIN(sale_time) FROM sale_event_unpartitioned), now())
+                        AT TIME ZONE 'UTC'),
+    date_trunc('month', now() AT TIME ZONE 'UTC') + INTERVAL '2 months',
+    INTERVAL '1 month') AS month;
+
+INSERT INTO sale_event(sale_id, sale_time, amount, item_id, country_id, sale_key)
+OVERRIDING SYSTEM VALUE
+SELECT sale_id, sale_time, amount, item_id, country_id, sale_key
+FROM sale_event_unpartitioned;
+
+SELECT setval(pg_get_serial_sequence('sale_event', 'sale_id'), COALESCE(MAX(sale_id), 0) + 1, false)
+FROM sale_event;
+
+DROP TABLE sale_event_unpartitioned;
+
+COMMIT;
@@ -0,0 +1,68 @@
+-- Adds the hourly and daily rollups of the sales, which the loaders keep up to date
+-- in the same transaction as the sales, and fills them from the sales already loaded.
+
+BEGIN;
+
+CREATE TABLE sale_hour_item(
+    sale_hour TIMESTAMPTZ NOT NULL,
+    item_id INT NOT NULL,
+    sale_count INT NOT NULL,
+    revenue BIGINT NOT NULL,
+    PRIMARY KEY (sale_hour, item_id),
+    FOREIGN KEY (item_id) REFERENCES item(item_id)
+);
+
+CREATE TABLE sale_hour_artist(
+    sale_hour TIMESTAMPTZ NOT NULL,
+    artist_id INT NOT NULL,
+    sale_count INT NOT NULL,
+    revenue BIGINT NOT NULL,
+    PRIMARY KEY (sale_hour, artist_id),
+    FOREIGN KEY (artist_id) REFERENCES artist(artist_id)
+);
+
+CREATE TABLE sale_hour_genre(
+    sale_hour TIMESTAMPTZ NOT NULL,
+    genre_id SMALLINT NOT NULL,
+    sale_count INT NOT NULL,
+    revenue BIGINT NOT NULL,
+    PRIMARY KEY (sale_hour, genre_id),
+    FOREIGN KEY (genre_id) REFERENCES genre(genre_id)
+);
+
+CREATE TABLE sale_day_country(
+    sale_day DATE NOT NULL,
+    country_id SMALLINT NOT NULL,
+    sale_count INT NOT NULL,
+    revenue BIGINT NOT NULL,
+    PRIMARY KEY (sale_day, country_id),
+    FOREIGN KEY (country_id) REFERENCES country(country_id)
+);
+
+INSERT INTO sale_hour_item(sale_hour, item_id, sale_count, revenue)
+SELECT date_trunc('hour', sale_time, 'UTC'), item_id, COUNT(*), SUM(amount)
+FROM sale_event
+GROUP BY 1, 2;
+
+INSERT INTO sale_hour_artist(sale_hour, artist_id, sale_count, revenue)
+SELECT date_trunc('hour', sale_event.sale_time, 'UTC'), item.artist_id,
+    COUNT(*), SUM(sale_event.amount)
+FROM sale_event
+JOIN item
+ON item.item_id = sale_event.item_id
+GROUP BY 1, 2;
+
+INSERT INTO sale_hour_genre(sale_hour, genre_id, sale_count, revenue)
+SELECT date_trunc('hour', sale_event.sale_time, 'UTC'), item_genre.genre_id,
+    COUNT(*), SUM(sale_event.amount)
+FROM sale_event
+JOIN item_genre
+ON item_genre.item_id = sale_event.item_id
+GROUP BY 1, 2;
+
+INSERT INTO sale_day_country(sale_day, country_id, sale_count, revenue)
+SELECT (sale_time AT TIME ZONE 'UTC')::DATE, country_id, COUNT(*), SUM(amount)
+FROM sale_event
+GROUP BY 1, 2;
+
+COMMIT;
@@ -1,31 +1,130 @@
 """Script which runs the full ETL pipeline."""
+from argparse import ArgumentParser
 from datetime import datetime
+from functools import partial
+from os import environ
+import signal
+from threading import Event
 from time import perf_counter
+from typing import Callable
 
 from dotenv import load_dotenv
+from psycopg2 import extensions, Error
 
-from extract import load_sales_data, extract_data_from_json
+from cache import PageCache, TagCache
+from dimensions import DimensionCache
+from extract import (load_sales_data, extract_data_from_json,
+                     get_latest_utc_date, get_session, MAX_WORKERS)
 from transform import clean_dataframe, convert_to_df
-from load import get_db_connection, load
+from load import (get_db_connection, get_watermark, update_watermark,
+                  create_partitions, load)
+import staging_load
 
-if __name__ == "__main__":
+POLL_INTERVAL_SECONDS = 300
+LOAD_ENGINES = {"rows": load, "staging": staging_load.load}
+
+
+def run_pipeline(db_connection: extensions.connection, page_cache: PageCache,
+                 tag_cache: TagCache, max_workers: int = MAX_WORKERS,
+                 loader: Callable = load) -> None:
+    """
+    Extracts, transforms and loads all the sales made since the last run.
+    """
     start = perf_counter()
+    watermark = get_watermark(db_connection)
+
     # Extract
-    sales_data = load_sales_data(datetime.now())
+    sales_data = load_sales_data(datetime.now(), watermark)
     print("Loaded!", perf_counter() - start)
-    extracted_data = extract_data_from_json(sales_data)
+    hits, misses = page_cache.hits, page_cache.misses
+    extracted_data = extract_data_from_json(
+        sales_data, max_workers, page_cache, watermark)
+    page_cache.evict()
     print("Extracted!", perf_counter() - start)
+    print(f"Page cache hits: {page_cache.hits - hits}, misses: {page_cache.misses - misses}")
 
-    # Transform
-    extracted_data_df = convert_to_df(extracted_data)
-    print("Converted!", perf_counter() - start)
-    clean_data_exploded, clean_data = clean_dataframe(extracted_data_df)
-    print("Transformed!", perf_counter() - start)
+    if extracted_data:
+        # Transform
+        extracted_data_df = convert_to_df(extracted_data)
+        print("Converted!", perf_counter() - start)
+        hits, misses = tag_cache.hits, tag_cache.misses
+        clean_data_exploded, clean_data = clean_dataframe(extracted_data_df, tag_cache)
+        print("Transformed!", perf_counter() - start)
+        print(f"Tag cache hits: {tag_cache.hits - hits}, misses: {tag_cache.misses - misses}")
 
-    # Load
-    load_dotenv()
-    con = get_db_connection()
-    load(con, clean_data_exploded, clean_data)
-    print("Loaded!", perf_counter() - start)
+        # Load
+        create_partitions(db_connection)
+        loader(db_connection, clean_data_exploded, clean_data)
+        print("Loaded!", perf_counter() - start)
+    else:
+        print("No new sales.")
+
+    latest_utc_date = get_latest_utc_date(sales_data)
+    if latest_utc_date is not None:
+        update_watermark(db_connection, latest_utc_date)
 
     print(f"Time taken: {perf_counter() - start}")
+
+
+def run_daemon(page_cache: PageCache, tag_cache: TagCache,
+               interval: float = POLL_INTERVAL_SECONDS, max_workers: int = MAX_WORKERS,
+               loader: Callable = load) -> None:
+    """
+    Runs the pipeline every interval seconds in the same process, so the NLP model,
+    HTTP session, database connection and page cache stay warm between runs.
+    Stops cleanly after the current run on SIGTERM or SIGINT.
+    """
+    stop = Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    db_connection = None
+    while not stop.is_set():
+        started = perf_counter()
+        try:
+            if db_connection is None or db_connection.closed:
+                db_connection = get_db_connection()
+            run_pipeline(db_connection, page_cache, tag_cache, max_workers, loader)
+        except Error as exc:
+            print(f"Database error, reconnecting on the next run: {exc}")
+            if db_connection is not None:
+                db_connection.close()
+            db_connection = None
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            print(f"Pipeline run failed: {exc}")
+            if db_connection is not None and not db_connection.closed:
+                db_connection.rollback()
+        stop.wait(max(0, interval - (perf_counter() - started)))
+
+    if db_connection is not None:
+        db_connection.close()
+    print("Pipeline stopped.")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Runs the Bandcamp ETL pipeline.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep running and poll the salesfeed on an interval")
+    args = parser.parse_args()
+
+    load_dotenv()
+    workers = int(environ.get("MAX_WORKERS", MAX_WORKERS))
+    get_session(workers)
+    load_engine = LOAD_ENGINES[environ.get("LOAD_ENGINE", "rows")]
+    if load_engine is load:
+        load_engine = partial(load, dimensions=DimensionCache(
+            environ.get("DIMENSION_CACHE_PATH")))
+    pages = PageCache(environ.get("PAGE_CACHE_PATH", "page_cache.db"))
+    cleaned_tags = TagCache(environ.get("TAG_CACHE_PATH", "tag_cache.db"))
+
+    if args.daemon:
+        run_daemon(pages, cleaned_tags,
+                   float(environ.get("POLL_INTERVAL_SECONDS", POLL_INTERVAL_SECONDS)),
+                   workers, load_engine)
+    else:
+        con = get_db_connection()
+        run_pipeline(con, pages, cleaned_tags, workers, load_engine)
+        con.close()
+
+    pages.close()
+    cleaned_tags.close()
@@ -1,5 +1,10 @@
 source .env
 export PGPASSWORD=$DB_PASSWORD
+psql -h $DB_IP -p $DB_PORT -U $DB_USER -c "DELETE FROM watermark;"
+psql -h $DB_IP -p $DB_PORT -U $DB_USER -c "DELETE FROM sale_hour_item;"
+psql -h $DB_IP -p $DB_PORT -U $DB_USER -c "DELETE FROM sale_hour_artist;"
+psql -h $DB_IP -p $DB_PORT -U $DB_USER -c "DELETE FROM sale_hour_genre;"
+psql -h $DB_IP -p $DB_PORT -U $DB_USER -c "DELETE FROM sale_day_country;"
 psql -h $DB_IP -p $DB_PORT -U $DB_USER -c "DELETE FROM sale_event;"
 psql -h $DB_IP -p $DB_PORT -U $DB_USER -c "DELETE FROM item_genre;"
 psql -h $DB_IP -p $DB_PORT -U $DB_USER -c "DELETE FROM genre;"
@@ -0,0 +1,65 @@
+"""
+Script which keeps the hourly and daily rollups of the sales up to date, by adding
+each batch of new sales to them in the same statement that inserts the sales.
+"""
+
+from psycopg2 import sql
+
+ROLLUP_QUERY = sql.SQL("""
+    WITH new_sale AS (
+        {sale_insert}
+        RETURNING sale_time, amount, item_id, country_id
+    ),
+    hour_item AS (
+        INSERT INTO sale_hour_item(sale_hour, item_id, sale_count, revenue)
+        SELECT date_trunc('hour', sale_time, 'UTC'), item_id, COUNT(*), SUM(amount)
+        FROM new_sale
+        GROUP BY 1, 2
+        ON CONFLICT (sale_hour, item_id) DO UPDATE
+        SET sale_count = sale_hour_item.sale_count + EXCLUDED.sale_count,
+            revenue = sale_hour_item.revenue + EXCLUDED.revenue
+    ),
+    hour_artist AS (
+        INSERT INTO sale_hour_artist(sale_hour, artist_id, sale_count, revenue)
+        SELECT date_trunc('hour', new_sale.sale_time, 'UTC'), item.artist_id,
+            COUNT(*), SUM(new_sale.amount)
+        FROM new_sale
+        JOIN item
+        ON item.item_id = new_sale.item_id
+        GROUP BY 1, 2
+        ON CONFLICT (sale_hour, artist_id) DO UPDATE
+        SET sale_count = sale_hour_artist.sale_count + EXCLUDED.sale_count,
+            revenue = sale_hour_artist.revenue + EXCLUDED.revenue
+    ),
+    hour_genre AS (
+        INSERT INTO sale_hour_genre(sale_hour, genre_id, sale_count, revenue)
+        SELECT date_trunc('hour', new_sale.sale_time, 'UTC'), item_genre.genre_id,
+            COUNT(*), SUM(new_sale.amount)
+        FROM new_sale
+        JOIN item_genre
+        ON item_genre.item_id = new_sale.item_id
+        GROUP BY 1, 2
+        ON CONFLICT (sale_hour, genre_id) DO UPDATE
+        SET sale_count = sale_hour_genre.sale_count + EXCLUDED.sale_count,
+            revenue = sale_hour_genre.revenue + EXCLUDED.revenue
+    ),
+    day_country AS (
+        INSERT INTO sale_day_country(sale_day, country_id, sale_count, revenue)
+        SELECT (sale_time AT TIME ZONE 'UTC')::DATE, country_id, COUNT(*), SUM(amount)
+        FROM new_sale
+        GROUP BY 1, 2
+        ON CONFLICT (sale_day, country_id) DO UPDATE
+        SET sale_count = sale_day_country.sale_count + EXCLUDED.sale_count,
+            revenue = sale_day_country.revenue + EXCLUDED.revenue
+    )
+    SELECT COUNT(*) FROM new_sale;
+    """)
+
+
+def get_rollup_query(sale_insert: str) -> sql.Composed:
+    """
+    Wraps a query inserting sales into sale_event, which must skip conflicting sales
+    and have no RETURNING clause, so the sales it adds are also added to the rollups.
+    The wrapped query returns the number of sales added.
+    """
+    return ROLLUP_QUERY.format(sale_insert=sql.SQL(sale_insert))
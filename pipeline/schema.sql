@@ -1,5 +1,10 @@
 -- This file should contain table definitions for the database.
 
+DROP TABLE IF EXISTS watermark;
+DROP TABLE IF EXISTS sale_hour_item;
+DROP TABLE IF EXISTS sale_hour_artist;
+DROP TABLE IF EXISTS sale_hour_genre;
+DROP TABLE IF EXISTS sale_day_country;
 DROP TABLE IF EXISTS sale_event;
 DROP TABLE IF EXISTS country;
 DROP TABLE IF EXISTS item_genre;
@@ -34,6 +39,7 @@ CREATE TABLE item(
     artist_id INT NOT NULL,
     item_image VARCHAR NOT NULL,
     PRIMARY KEY (item_id),
+    UNIQUE (artist_id, item_name, item_type_id),
     FOREIGN KEY (item_type_id) REFERENCES item_type(item_type_id) ON DELETE CASCADE,
     FOREIGN KEY (artist_id) REFERENCES artist(artist_id) ON DELETE CASCADE
 );
@@ -60,9 +66,93 @@ CREATE TABLE sale_event(
     amount INT NOT NULL,
     item_id INT NOT NULL,
     country_id SMALLINT NOT NULL,
-    PRIMARY KEY (sale_id),
+    sale_key VARCHAR NOT NULL,
+    PRIMARY KEY (sale_id, sale_time),
+    UNIQUE (sale_key, sale_time),
     FOREIGN KEY (item_id) REFERENCES item(item_id),
     FOREIGN KEY (country_id) REFERENCES country(country_id)
+) PARTITION BY RANGE (sale_time);
+
+CREATE TABLE sale_event_default PARTITION OF sale_event DEFAULT;
+
+CREATE INDEX sale_event_sale_time_idx ON sale_event(sale_time);
+CREATE INDEX sale_event_item_id_idx ON sale_event(item_id);
+CREATE INDEX sale_event_country_id_idx ON sale_event(country_id);
+
+-- Creates the monthly partitions of sale_event from the month of start_date
+-- to months_ahead months later, moving any of their sales out of the default partition.
+CREATE OR REPLACE FUNCTION create_sale_event_partitions(start_date DATE, months_ahead INT)
+RETURNS VOID AS $$
+DECLARE
+    month_start TIMESTAMP;
+    partition_name TEXT;
+BEGIN
+    FOR month_number IN 0..months_ahead LOOP
+        month_start := date_trunc('month', start_date) + make_interval(months => month_number);
+        partition_name := 'sale_event_' || to_char(month_start, 'YYYY_MM');
+
+        CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+
+        EXECUTE format('CREATE TABLE %I (LIKE sale_event INCLUDING DEFAULTS)', partition_name);
+        EXECUTE format('
+            WITH moved AS (
+                DELETE FROM sale_event_default WHERE sale_time >= %L AND sale_time < %L
+                RETURNING *
+            )
+            INSERT INTO %I SELECT * FROM moved',
+            month_start AT TIME ZONE 'UTC',
+            (month_start + INTERVAL '1 month') AT TIME ZONE 'UTC',
+            partition_name);
+        EXECUTE format('ALTER TABLE sale_event ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+            partition_name,
+            month_start AT TIME ZONE 'UTC',
+            (month_start + INTERVAL '1 month') AT TIME ZONE 'UTC');
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT create_sale_event_partitions(CURRENT_DATE, 2);
+
+CREATE TABLE sale_hour_item(
+    sale_hour TIMESTAMPTZ NOT NULL,
+    item_id INT NOT NULL,
+    sale_count INT NOT NULL,
+    revenue BIGINT NOT NULL,
+    PRIMARY KEY (sale_hour, item_id),
+    FOREIGN KEY (item_id) REFERENCES item(item_id)
+);
+
+CREATE TABLE sale_hour_artist(
+    sale_hour TIMESTAMPTZ NOT NULL,
+    artist_id INT NOT NULL,
+    sale_count INT NOT NULL,
+    revenue BIGINT NOT NULL,
+    PRIMARY KEY (sale_hour, artist_id),
+    FOREIGN KEY (artist_id) REFERENCES artist(artist_id)
+);
+
+CREATE TABLE sale_hour_genre(
+    sale_hour TIMESTAMPTZ NOT NULL,
+    genre_id SMALLINT NOT NULL,
+    sale_count INT NOT NULL,
+    revenue BIGINT NOT NULL,
+    PRIMARY KEY (sale_hour, genre_id),
+    FOREIGN KEY (genre_id) REFERENCES genre(genre_id)
+);
+
+CREATE TABLE sale_day_country(
+    sale_day DATE NOT NULL,
+    country_id SMALLINT NOT NULL,
+    sale_count INT NOT NULL,
+    revenue BIGINT NOT NULL,
+    PRIMARY KEY (sale_day, country_id),
+    FOREIGN KEY (country_id) REFERENCES country(country_id)
+);
+
+CREATE TABLE watermark(
+    watermark_name VARCHAR NOT NULL,
+    last_utc_date DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (watermark_name)
 );
 
 CREATE TABLE subscribers(
@@ -0,0 +1,154 @@
+"""
+Script which loads the data into the database by copying each batch into a staging table
+and inserting every table from it with a few set-based statements.
+"""
+
+from io import StringIO
+
+from psycopg2 import extensions
+import pandas as pd
+
+from rollups import get_rollup_query
+
+STAGING_COLUMNS = ["sale_key", "at", "amount_paid_usd", "country",
+                   "artist", "title", "type", "image", "tags"]
+
+
+def create_staging_table(cur: extensions.cursor) -> None:
+    """
+    Creates a temporary table for the batch that is dropped when the transaction ends.
+    """
+    cur.execute("""
+        CREATE TEMP TABLE staging_sale(
+            sale_key VARCHAR NOT NULL,
+            sale_time TIMESTAMPTZ NOT NULL,
+            amount INT NOT NULL,
+            country VARCHAR NOT NULL,
+            artist_name VARCHAR NOT NULL,
+            item_name VARCHAR NOT NULL,
+            item_type VARCHAR NOT NULL,
+            item_image VARCHAR NOT NULL,
+            genre VARCHAR NOT NULL
+        ) ON COMMIT DROP;
+        """)
+
+
+def get_staging_rows(flat_dataframe: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns one row per sale and genre, with genres and artists in lower case
+    the same way as the other loader stores them.
+    """
+    rows = flat_dataframe[STAGING_COLUMNS].copy()
+
+    rows["tags"] = rows["tags"].str.lower()
+    rows["artist"] = rows["artist"].str.lower()
+
+    return rows
+
+
+def copy_to_staging_table(cur: extensions.cursor, flat_dataframe: pd.DataFrame) -> None:
+    """
+    Streams the batch into the staging table with COPY.
+    """
+    buffer = StringIO()
+    get_staging_rows(flat_dataframe).to_csv(buffer, header=False, index=False)
+    buffer.seek(0)
+
+    cur.copy_expert("COPY staging_sale FROM STDIN WITH (FORMAT csv);", buffer)
+
+
+def insert_dimensions(cur: extensions.cursor) -> None:
+    """
+    Adds any new genres, artists and countries in the staging table into the database.
+    """
+    cur.execute("""
+        INSERT INTO genre(genre)
+        SELECT DISTINCT genre FROM staging_sale
+        ON CONFLICT DO NOTHING;
+
+        INSERT INTO artist(artist_name)
+        SELECT DISTINCT artist_name FROM staging_sale
+        ON CONFLICT DO NOTHING;
+
+        INSERT INTO country(country)
+        SELECT DISTINCT country FROM staging_sale
+        ON CONFLICT DO NOTHING;
+        """)
+
+
+def insert_items(cur: extensions.cursor) -> None:
+    """
+    Adds any new items in the staging table into the database,
+    along with the genres of each new item.
+    """
+    cur.execute("""
+        WITH new_item AS (
+            INSERT INTO item(item_name, artist_id, item_type_id, item_image)
+            SELECT DISTINCT ON (s.item_name, artist.artist_id, item_type.item_type_id)
+                s.item_name, artist.artist_id, item_type.item_type_id, s.item_image
+            FROM staging_sale AS s
+            JOIN artist
+            ON artist.artist_name = s.artist_name
+            JOIN item_type
+            ON item_type.item_type = s.item_type
+            ORDER BY s.item_name, artist.artist_id, item_type.item_type_id
+            ON CONFLICT (artist_id, item_name, item_type_id) DO NOTHING
+            RETURNING item_id, item_name, artist_id, item_type_id
+        )
+        INSERT INTO item_genre(item_id, genre_id)
+        SELECT DISTINCT new_item.item_id, genre.genre_id
+        FROM new_item
+        JOIN artist
+        ON artist.artist_id = new_item.artist_id
+        JOIN item_type
+        ON item_type.item_type_id = new_item.item_type_id
+        JOIN staging_sale AS s
+        ON s.item_name = new_item.item_name
+        AND s.artist_name = artist.artist_name
+        AND s.item_type = item_type.item_type
+        JOIN genre
+        ON genre.genre = s.genre;
+        """)
+
+
+def insert_sales_events(cur: extensions.cursor) -> int:
+    """
+    Adds the sales in the staging table into the database, and to the rollups,
+    skipping sales already loaded. Returns the number of sales added.
+    """
+    cur.execute(get_rollup_query("""
+        INSERT INTO sale_event(sale_time, amount, country_id, item_id, sale_key)
+        SELECT DISTINCT ON (s.sale_key)
+            s.sale_time, s.amount, country.country_id, item.item_id, s.sale_key
+        FROM staging_sale AS s
+        JOIN country
+        ON country.country = s.country
+        JOIN artist
+        ON artist.artist_name = s.artist_name
+        JOIN item_type
+        ON item_type.item_type = s.item_type
+        JOIN item
+        ON item.artist_id = artist.artist_id
+        AND item.item_name = s.item_name
+        AND item.item_type_id = item_type.item_type_id
+        ORDER BY s.sale_key
+        ON CONFLICT DO NOTHING
+        """))
+    return cur.fetchone()[0]
+
+
+def load(db_connection: extensions.connection, flat_dataframe: pd.DataFrame,
+         not_flat_dataframe: pd.DataFrame) -> None:  # pylint: disable=unused-argument
+    """
+    Takes the dataframes of all the new sales data and loads it into the database
+    in a single transaction. Only the flat dataframe is needed, as it holds every sale.
+    """
+    with db_connection.cursor() as cur:
+        create_staging_table(cur)
+        copy_to_staging_table(cur, flat_dataframe)
+        insert_dimensions(cur)
+        insert_items(cur)
+        sales_added = insert_sales_events(cur)
+        db_connection.commit()
+
+    print(f"{sales_added} Sales Added!")
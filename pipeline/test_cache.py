@@ -0,0 +1,122 @@
+"""
+Tests the caches within cache.py script
+"""
+
+from unittest.mock import patch
+
+from cache import PageCache, TagCache
+
+EXAMPLE_URL = "https://example.bandcamp.com/album/example"
+
+
+class TestPageCache:
+    """
+    Class used for testing the page cache
+    """
+
+    def test_get_missing_url(self, tmp_path):
+        """
+        Test whether an uncached url returns None and counts as a miss
+        """
+        cache = PageCache(str(tmp_path / "cache.db"))
+
+        assert cache.get(EXAMPLE_URL) is None
+        assert cache.misses == 1
+        assert cache.hits == 0
+
+    def test_set_and_get(self, tmp_path):
+        """
+        Test whether a cached page is returned and counts as a hit
+        """
+        cache = PageCache(str(tmp_path / "cache.db"))
+        cache.set(EXAMPLE_URL, "Sample Title", ["rock", "pop"])
+
+        assert cache.get(EXAMPLE_URL) == {
+            "title": "Sample Title", "tags": ["rock", "pop"]}
+        assert cache.hits == 1
+        assert cache.misses == 0
+
+    def test_cache_persists(self, tmp_path):
+        """
+        Test whether cached pages survive reopening the cache file
+        """
+        path = str(tmp_path / "cache.db")
+        cache = PageCache(path)
+        cache.set(EXAMPLE_URL, "Sample Title", ["rock"])
+        cache.close()
+
+        assert PageCache(path).get(EXAMPLE_URL)["title"] == "Sample Title"
+
+    def test_expired_entry(self, tmp_path):
+        """
+        Test whether entries older than the ttl are treated as misses and evicted
+        """
+        cache = PageCache(str(tmp_path / "cache.db"), ttl=60)
+        with patch("cache.time", return_value=0):
+            cache.set(EXAMPLE_URL, "Sample Title", ["rock"])
+
+        assert cache.get(EXAMPLE_URL) is None
+        cache.evict()
+        assert cache.connection.execute(
+            "SELECT COUNT(*) FROM page;").fetchone()[0] == 0
+
+    def test_evict_oldest_entries(self, tmp_path):
+        """
+        Test whether the oldest entries are evicted once the cache is full
+        """
+        cache = PageCache(str(tmp_path / "cache.db"), max_entries=2)
+        for index, url in enumerate(["a", "b", "c"]):
+            with patch("cache.time", return_value=1000000000 + index):
+                cache.set(url, "Sample Title", [])
+
+        with patch("cache.time", return_value=1000000010):
+            cache.evict()
+            assert cache.get("a") is None
+            assert cache.get("b") is not None
+            assert cache.get("c") is not None
+
+
+class TestTagCache:
+    """
+    Class used for testing the tag cache
+    """
+
+    def test_set_and_get(self):
+        """
+        Test whether cleaned and dropped tags are both remembered
+        """
+        cache = TagCache()
+        cache.set("rock", ["Rock"])
+        cache.set("london", [])
+
+        assert cache.get("rock") == ["Rock"]
+        assert cache.get("london") == []
+        assert cache.get("jazz") is None
+        assert (cache.hits, cache.misses) == (2, 1)
+
+    def test_least_recently_used_is_forgotten(self):
+        """
+        Test whether the in-memory cache stays within its size
+        """
+        cache = TagCache(max_size=2)
+        cache.set("rock", ["Rock"])
+        cache.set("jazz", ["Jazz"])
+        cache.get("rock")
+        cache.set("pop", ["Pop"])
+
+        assert cache.get("jazz") is None
+        assert cache.get("rock") == ["Rock"]
+        assert cache.get("pop") == ["Pop"]
+
+    def test_cache_persists(self, tmp_path):
+        """
+        Test whether cleaned tags survive reopening the cache file
+        """
+        path = str(tmp_path / "tags.db")
+        cache = TagCache(path, max_size=1)
+        cache.set("rock", ["Rock"])
+        cache.set("jazz", ["Jazz"])
+
+        assert cache.get("rock") == ["Rock"]
+        cache.close()
+        assert TagCache(path).get("jazz") == ["Jazz"]
@@ -0,0 +1,84 @@
+"""
+Tests the DimensionCache within dimensions.py script
+"""
+
+import json
+from unittest.mock import MagicMock
+
+from dimensions import DimensionCache
+
+
+def get_mock_connection(rows: list[list[tuple]]) -> MagicMock:
+    """
+    Returns a mock database connection whose cursor returns the given rows
+    for each dimension table in turn.
+    """
+    connection = MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchall.side_effect = rows
+    return connection
+
+
+class TestDimensionCache:
+    """
+    Class used for testing the dimension cache
+    """
+
+    def test_refresh_is_incremental(self):
+        """
+        Test whether only rows newer than the last seen id are requested
+        """
+        cache = DimensionCache()
+        cache.refresh(get_mock_connection(
+            [[(1, "rock"), (2, "jazz")], [(1, "artist")], [], [(7, "title", 1, 1)], [(1, "album")]]))
+
+        assert cache.ids["genre"] == {"rock": 1, "jazz": 2}
+        assert cache.ids["item"] == {("title", 1, 1): 7}
+        assert cache.last_seen_ids == {"genre": 2, "artist": 1, "country": 0,
+                                       "item": 7, "item_type": 1}
+
+        connection = get_mock_connection([[(3, "pop")], [], [], [], []])
+        cache.refresh(connection)
+        cursor = connection.cursor.return_value.__enter__.return_value
+
+        assert cache.ids["genre"] == {"rock": 1, "jazz": 2, "pop": 3}
+        assert [call.args[1] for call in cursor.execute.call_args_list] == [
+            (2,), (1,), (0,), (7,), (1,)]
+
+    def test_add_does_not_move_last_seen_id(self):
+        """
+        Test whether ids added from inserts don't skip rows on the next refresh
+        """
+        cache = DimensionCache()
+        cache.add("country", {"France": 4})
+
+        assert cache.ids["country"] == {"France": 4}
+        assert cache.last_seen_ids["country"] == 0
+
+    def test_snapshot(self, tmp_path):
+        """
+        Test whether the ids survive being saved and loaded again
+        """
+        path = str(tmp_path / "dimensions.json")
+        cache = DimensionCache(path)
+        cache.refresh(get_mock_connection(
+            [[(1, "rock")], [(2, "artist")], [(3, "France")], [(4, "title", 2, 1)], [(1, "album")]]))
+        cache.save_snapshot()
+
+        loaded = DimensionCache(path)
+
+        assert loaded.ids == cache.ids
+        assert loaded.last_seen_ids == cache.last_seen_ids
+
+    def test_old_snapshot_is_ignored(self, tmp_path):
+        """
+        Test whether a snapshot in an older format is discarded rather than loaded
+        """
+        path = tmp_path / "dimensions.json"
+        path.write_text(json.dumps({"ids": {"item": [["title", 4]]},
+                                    "last_seen_ids": {"item": 4}}))
+
+        loaded = DimensionCache(str(path))
+
+        assert loaded.ids["item"] == {}
+        assert loaded.last_seen_ids["item"] == 0
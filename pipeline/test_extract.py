@@ -12,10 +12,17 @@ from extract import (
     get_minute_rounded_down,
     unix_time_seconds,
     load_sales_data,
-    get_tags_from_url,
-    get_title_from_url,
-    extract_data_from_json
+    get_data_from_html,
+    extract_data_from_json,
+    get_html_for_urls,
+    get_page_metadata,
+    get_html,
+    create_session,
+    get_session,
+    get_latest_utc_date,
+    get_sale_key
 )
+from cache import PageCache
 
 EXAMPLE_DATETIME = datetime(2023, 1, 1)
 EXAMPLE_UNIX_TIME = 1672531200
@@ -34,43 +41,59 @@ class TestBandcampAPI:
         assert result == EXAMPLE_UNIX_TIME
         assert isinstance(result, int) is True
 
-    @patch("extract.requests.get")
-    def test_load_sales_data(self, mock_get):
+    @patch("extract.get_session")
+    def test_load_sales_data(self, mock_get_session):
         """
         Tests whether the appropriate sales data are returned - base cases
         """
         mock_response = MagicMock()
         mock_response.json.return_value = {"events": []}
-        mock_get.return_value = mock_response
+        mock_get_session.return_value.get.return_value = mock_response
         result = load_sales_data(EXAMPLE_DATETIME)
         assert result == {"events": []}
+        mock_get_session.return_value.get.assert_called_once_with(
+            f"https://bandcamp.com/api/salesfeed/1/get?start_date={EXAMPLE_UNIX_TIME - 300}",
+            timeout=20)
 
-    def test_get_tags_from_url(self):
+    @patch("extract.get_session")
+    def test_load_sales_data_from_watermark(self, mock_get_session):
         """
-        Test whether appropriate tags are extracted from html
+        Tests whether sales data is requested from the watermark when there is one
         """
-        html = '<a class="tag">rock</a>'
-        result = get_tags_from_url(html)
-        assert result == ["rock"]
+        load_sales_data(EXAMPLE_DATETIME, watermark=1641100800.75)
+        mock_get_session.return_value.get.assert_called_once_with(
+            "https://bandcamp.com/api/salesfeed/1/get?start_date=1641100800", timeout=20)
 
-    def test_get_title_from_url(self):
+    def test_get_data_from_html(self):
         """
-        Test whether the title of an album or track is found
+        Test whether the title and tags of an album or track are found
         """
-        html = '<h2 class="trackTitle">Sample Title</h2>'
-        result = get_title_from_url(html)
-        assert result == "Sample Title"
+        html = '<h2 class="trackTitle">Sample Title</h2><a class="tag">rock</a>'
+        result = get_data_from_html(html)
+        assert result == {"title": "Sample Title", "tags": ["rock"]}
+
+    def test_get_data_from_html_nested(self):
+        """
+        Test whether nested text and elements with several classes are found
+        """
+        html = """<h2 class="trackTitle inline">
+                    Sample <span>Title</span>
+                  </h2>
+                  <a class="tag" href="/rock">rock</a>
+                  <a class="tag extra" href="/pop">pop</a>
+                  <a class="tags">not a tag</a>"""
+        result = get_data_from_html(html)
+        assert result["title"].strip() == "Sample Title"
+        assert result["tags"] == ["rock", "pop"]
 
     @patch("extract.get_html")
-    @patch("extract.get_tags_from_url")
-    @patch("extract.get_title_from_url")
-    def test_extract_data_from_json(self, mock_get_title, mock_get_tags, mock_get_html):
+    @patch("extract.get_data_from_html")
+    def test_extract_data_from_json(self, mock_get_data, mock_get_html):
         """
         Test whether the appropriate data is extracted from a given JSON
         """
         mock_get_html.return_value = "<html></html>"
-        mock_get_tags.return_value = ["rock"]
-        mock_get_title.return_value = "Sample Title"
+        mock_get_data.return_value = {"title": "Sample Title", "tags": ["rock"]}
 
         sales_json = {
             "events": [
@@ -100,10 +123,151 @@ class TestBandcampAPI:
             "artist": "Artist",
             "at": datetime.utcfromtimestamp(1641100800).strftime("%m/%d/%Y, %H:%M:%S"),
             "type": "album",
-            "image": "https://exampleimage.com"
+            "image": "https://exampleimage.com",
+            "sale_key": get_sale_key(sales_json["events"][0]["items"][0])
         }]
         assert result == expected
 
+    @patch("extract.get_html")
+    @patch("extract.get_data_from_html")
+    def test_extract_data_from_json_watermark(self, mock_get_data, mock_get_html):
+        """
+        Test whether sales at or before the watermark are skipped
+        """
+        mock_get_html.return_value = "<html></html>"
+        mock_get_data.return_value = {"title": "Sample Title", "tags": ["rock"]}
+        item = {"amount_paid_usd": 10, "country": "US", "artist_name": "Artist",
+                "item_type": "a", "url": "https://example.com",
+                "art_url": "https://exampleimage.com"}
+        sales_json = {"events": [{"event_type": "sale", "items": [
+            {**item, "utc_date": 1641100800},
+            {**item, "utc_date": 1641100801.5}]}]}
+
+        result = extract_data_from_json(sales_json, watermark=1641100800)
+
+        assert len(result) == 1
+        assert result[0]["sale_key"] == get_sale_key(
+            sales_json["events"][0]["items"][1])
+        assert get_latest_utc_date(sales_json) == 1641100801.5
+        assert get_latest_utc_date({"events": []}) is None
+
+    def test_get_sale_key(self):
+        """
+        Test whether sale keys are stable and differ between sales
+        """
+        item = {"utc_date": 1641100800.25, "url": "https://example.com", "country": "US",
+                "amount_paid_usd": 10, "artist_name": "Artist"}
+        assert get_sale_key(item) == get_sale_key(dict(item))
+        assert get_sale_key(item) != get_sale_key({**item, "utc_date": 1641100800.5})
+
+    @patch("extract.get_html")
+    def test_get_html_for_urls_keeps_order(self, mock_get_html):
+        """
+        Test whether pages fetched concurrently are returned in the order of the urls
+        """
+        mock_get_html.side_effect = lambda url: f"<html>{url}</html>"
+        urls = [f"https://example.com/{i}" for i in range(20)]
+
+        result = get_html_for_urls(urls, max_workers=4)
+
+        assert result == [f"<html>{url}</html>" for url in urls]
+        assert get_html_for_urls([]) == []
+
+    @patch("extract.get_html")
+    def test_get_page_metadata_uses_cache(self, mock_get_html, tmp_path):
+        """
+        Test whether cached pages are not scraped again
+        """
+        mock_get_html.return_value = '<h2 class="trackTitle">New</h2><a class="tag">rock</a>'
+        cache = PageCache(str(tmp_path / "cache.db"))
+        cache.set("https://cached.com", "Cached", ["jazz"])
+
+        result = get_page_metadata(
+            ["https://cached.com", "https://new.com"], page_cache=cache)
+
+        assert result == [{"title": "Cached", "tags": ["jazz"]},
+                          {"title": "New", "tags": ["rock"]}]
+        mock_get_html.assert_called_once_with("https://new.com")
+        assert cache.get("https://new.com") == {"title": "New", "tags": ["rock"]}
+
+    @patch("extract.get_html")
+    def test_get_page_metadata_deduplicates_urls(self, mock_get_html):
+        """
+        Test whether an item sold several times in a batch is only scraped once
+        """
+        mock_get_html.side_effect = lambda url: f'<h2 class="trackTitle">{url}</h2>'
+        urls = ["https://a.com", "https://b.com", "https://a.com", "https://a.com"]
+
+        result = get_page_metadata(urls)
+
+        assert [page["title"] for page in result] == urls
+        assert mock_get_html.call_count == 2
+
+    @patch("extract.get_html")
+    def test_extract_data_from_json_skips_bad_pages(self, mock_get_html):
+        """
+        Test whether sales of pages that fail, are empty, aren't UTF-8 or have
+        no title are dropped and the rest of the batch is still extracted
+        """
+        def get_html(url):
+            if url == "https://deleted.com":
+                raise HTTPError("404 Client Error: Not Found")
+            if url == "https://untitled.com":
+                return "<html></html>"
+            if url == "https://empty.com":
+                return ""
+            if url == "https://latin1.com":
+                raise UnicodeDecodeError("utf-8", b"\xe9", 0, 1, "invalid continuation byte")
+            return '<h2 class="trackTitle">Title</h2><a class="tag">rock</a>'
+
+        mock_get_html.side_effect = get_html
+        item = {"amount_paid_usd": 10, "country": "US", "artist_name": "Artist",
+                "item_type": "a", "utc_date": 1641100800,
+                "art_url": "https://exampleimage.com"}
+        sales_json = {"events": [{"event_type": "sale", "items": [
+            {**item, "url": "https://deleted.com"},
+            {**item, "url": "https://example.com"},
+            {**item, "url": "https://untitled.com"},
+            {**item, "url": "https://empty.com"},
+            {**item, "url": "https://latin1.com"}]}]}
+
+        result = extract_data_from_json(sales_json)
+
+        assert [sale["title"] for sale in result] == ["Title"]
+        assert get_page_metadata(["https://deleted.com"]) == [None]
+
+    @patch("extract.get_session")
+    def test_get_html(self, mock_get_session):
+        """
+        Test whether pages are requested through the shared session
+        """
+        mock_get_session.return_value.get.return_value.content = "<html>é</html>".encode()
+        assert get_html("https://example.com") == "<html>é</html>"
+        mock_get_session.return_value.get.assert_called_once_with(
+            "https://example.com", timeout=20)
+
+    def test_create_session(self):
+        """
+        Test whether the session pools connections and retries failed requests
+        """
+        adapter = create_session(pool_size=4).get_adapter("https://bandcamp.com")
+        assert adapter.max_retries.total == 3
+        assert 503 in adapter.max_retries.status_forcelist
+        assert adapter._pool_maxsize == 4  # pylint: disable=protected-access
+        assert adapter._pool_block is True  # pylint: disable=protected-access
+
+    def test_get_session_pool_size(self):
+        """
+        Test whether the shared session is created with the configured pool size
+        and then reused
+        """
+        with patch("extract.SESSION", None):
+            session = get_session(12)
+            adapter = session.get_adapter("https://bandcamp.com")
+
+            assert adapter._pool_maxsize == 12  # pylint: disable=protected-access
+            assert get_session() is session
+
     def test_get_minute_rounded_down(self):
         """
         Test for base cases for func get_minute_rounded_down
@@ -118,20 +282,23 @@ class TestBandCampAPIFails:
     Tests whether appropriate responses occur when an error occurs
     """
 
-    @patch("extract.requests.get", side_effect=ConnectionError("Connection failed"))
-    def test_connection_error(self, mock_get):
+    @patch("extract.get_session")
+    def test_connection_error(self, mock_get_session):
         """Test whether a ConnectionError is thrown"""
+        mock_get_session.return_value.get.side_effect = ConnectionError("Connection failed")
         with pytest.raises(ConnectionError):
             load_sales_data(EXAMPLE_DATETIME)
 
-    @patch("extract.requests.get", side_effect=Timeout("The request timed out."))
-    def test_timeout_error(self, mock_get):
+    @patch("extract.get_session")
+    def test_timeout_error(self, mock_get_session):
         """Test whether a Timeout is thrown"""
+        mock_get_session.return_value.get.side_effect = Timeout("The request timed out.")
         with pytest.raises(Timeout):
             load_sales_data(EXAMPLE_DATETIME)
 
-    @patch("extract.requests.get", side_effect=HTTPError("url is invalid."))
-    def test_http_error(self, mock_get):
+    @patch("extract.get_session")
+    def test_http_error(self, mock_get_session):
         """Test whether a HTTPError is thrown"""
+        mock_get_session.return_value.get.side_effect = HTTPError("url is invalid.")
         with pytest.raises(HTTPError):
             load_sales_data(EXAMPLE_DATETIME)
@@ -0,0 +1,124 @@
+"""
+Tests the functions within load.py script
+"""
+
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+
+from load import (
+    get_item_key,
+    check_if_item_in_db,
+    add_items_to_database,
+    add_item_genres_to_database,
+    add_sales_events,
+    reset_load_state,
+    ITEMS_NOT_IN_DB,
+    ITEM_GENRES_NOT_IN_DB
+)
+
+ITEM_TYPES = {"album": 1, "track": 2}
+ARTISTS = {"artist a": 10, "artist b": 20}
+
+
+def get_sale(title: str, artist: str, **columns) -> pd.Series:
+    """
+    Returns a sale in the same shape as a row of the transformed dataframe
+    """
+    sale = {"title": title, "artist": artist, "type": "album", "image": "image.jpg",
+            "tags": "rock", "country": "France", "amount_paid_usd": 10,
+            "at": "01/02/2022, 05:20:00", "sale_key": "key"}
+    sale.update(columns)
+    return pd.Series(sale)
+
+
+class TestItemKeys:
+    """
+    Class used for testing how items are identified
+    """
+
+    def setup_method(self):
+        """
+        Empties the rows waiting to be inserted before each test
+        """
+        reset_load_state()
+
+    def test_same_title_different_artists(self):
+        """
+        Test whether items with the same title by different artists get separate keys
+        """
+        first = get_item_key(get_sale("Title", "Artist A"), ITEM_TYPES, ARTISTS)
+        second = get_item_key(get_sale("Title", "Artist B"), ITEM_TYPES, ARTISTS)
+
+        assert first == ("Title", 10, 1)
+        assert second == ("Title", 20, 1)
+
+    def test_new_items_are_queued_separately(self):
+        """
+        Test whether each new item is queued for insert with its genre under its own key
+        """
+        check_if_item_in_db(get_sale("Title", "Artist A"), {}, ITEM_TYPES, ARTISTS)
+        check_if_item_in_db(get_sale("Title", "Artist B", tags="Jazz"), {}, ITEM_TYPES, ARTISTS)
+        check_if_item_in_db(get_sale("Known", "Artist A"), {("Known", 10, 1): 5},
+                            ITEM_TYPES, ARTISTS)
+
+        assert ITEMS_NOT_IN_DB == {("Title", 10, 1, "image.jpg"),
+                                   ("Title", 20, 1, "image.jpg")}
+        assert ITEM_GENRES_NOT_IN_DB == {(("Title", 10, 1), "rock"),
+                                         (("Title", 20, 1), "jazz")}
+
+
+class TestLoadQueries:
+    """
+    Class used for testing the rows sent to the database
+    """
+
+    @patch("load.execute_values")
+    def test_add_items_to_database(self, mock_execute_values):
+        """
+        Test whether each item is upserted once and its id is keyed by its natural key
+        """
+        mock_execute_values.return_value = [("Title", 10, 1, 7), ("Title", 20, 1, 8)]
+        new_items = {("Title", 10, 1, "a.jpg"), ("Title", 10, 1, "b.jpg"),
+                     ("Title", 20, 1, "a.jpg")}
+
+        result = add_items_to_database(MagicMock(), new_items)
+
+        assert result == {("Title", 10, 1): 7, ("Title", 20, 1): 8}
+        rows = list(mock_execute_values.call_args.args[2])
+        assert sorted(row[:3] for row in rows) == [("Title", 10, 1), ("Title", 20, 1)]
+
+    @patch("load.execute_values")
+    def test_add_item_genres_to_database(self, mock_execute_values):
+        """
+        Test whether each item genre pair is inserted with the ids of its own item and genre
+        """
+        items = {("Title", 10, 1): 7, ("Title", 20, 1): 8}
+        genres = {"rock": 3, "jazz": 4}
+
+        add_item_genres_to_database(
+            MagicMock(), {(("Title", 10, 1), "rock"), (("Title", 20, 1), "jazz"),
+                          (("Title", 20, 1), "rock")}, items, genres)
+
+        mock_execute_values.assert_called_once()
+        assert mock_execute_values.call_args.args[2] == {(7, 3), (8, 4), (8, 3)}
+
+    @patch("load.execute_values")
+    def test_add_sales_events(self, mock_execute_values):
+        """
+        Test whether every sale is inserted in one statement with its resolved ids and sale key
+        """
+        connection = MagicMock()
+        sales = pd.DataFrame([
+            get_sale("Title", "Artist A", sale_key="k1"),
+            get_sale("Title", "Artist B", sale_key="k2", country="Japan", amount_paid_usd=5.0)])
+        items = {("Title", 10, 1): 7, ("Title", 20, 1): 8}
+
+        add_sales_events(connection, sales, {"France": 1, "Japan": 2}, items,
+                         ITEM_TYPES, ARTISTS)
+
+        mock_execute_values.assert_called_once()
+        assert mock_execute_values.call_args.args[2] == [
+            ("01/02/2022, 05:20:00", 10, 1, 7, "k1"),
+            ("01/02/2022, 05:20:00", 5, 2, 8, "k2")]
+        connection.commit.assert_called_once()
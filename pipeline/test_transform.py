@@ -5,13 +5,17 @@ from collections import Counter
 
 import pandas as pd
 
+from cache import TagCache
 from transform import (
     convert_to_df,
     clean_tags,
     clean_artists,
     clean_titles,
     clean_dataframe,
-    has_special_characters
+    has_special_characters,
+    get_cleaned_tags,
+    clean_artists_column,
+    clean_titles_column
 )
 
 
@@ -41,6 +45,28 @@ class TestTransform:
         assert Counter(clean_tags(["Rnb", "rock"])) == Counter(["R&B", "Rock"])
         assert Counter(clean_tags(["John-Doe", "jazz"])) == Counter(["Jazz"])
 
+    def test_clean_tags_uses_cache(self):
+        """
+        Tests whether cleaned tags are remembered and reused
+        """
+        tag_cache = TagCache()
+        tag_cache.set("stoner", ["Stoner Rock"])
+
+        assert clean_tags(["stoner", "jazz"], tag_cache) in (
+            ["Stoner Rock", "Jazz"], ["Jazz", "Stoner Rock"])
+        assert tag_cache.get("jazz") == ["Jazz"]
+        assert clean_tags(["stoner"], tag_cache) == ["Stoner Rock"]
+
+    def test_get_cleaned_tags(self):
+        """
+        Tests whether every unique tag is cleaned once in a batch
+        """
+        tag_cache = TagCache()
+        result = get_cleaned_tags(["rock", "Drum & Bass", "rock", ""], tag_cache)
+
+        assert result == {"rock": ["Rock"], "Drum & Bass": ["DNB"], "": []}
+        assert tag_cache.misses == 3
+
     def test_clean_titles(self):
         """
         Tests cleaning titles
@@ -59,6 +85,21 @@ class TestTransform:
         assert pd.isnull(clean_artists("Various Artists")) is True
         assert pd.isnull(clean_artists("Various")) is True
 
+    def test_clean_columns_match_row_by_row_cleaning(self):
+        """
+        Test whether the vectorised cleaning gives the same results as cleaning each row
+        """
+        names = pd.Series(["Artist1 ft. Artist2", "Bob featuring Bob2", "Just artist",
+                           "Various Artists", "Various", "漢字", "title",
+                           "\n    title    \n", "Untitled", "þ", "Daft.Punk ft. Bob"])
+
+        for vectorised, row_by_row in ((clean_artists_column, clean_artists),
+                                       (clean_titles_column, clean_titles)):
+            result = vectorised(names)
+            expected = names.apply(row_by_row)
+            assert result.isnull().equals(expected.isnull())
+            assert result.dropna().equals(expected.dropna().astype(result.dtype))
+
     def test_clean_dataframe(self):
         """
         Test whether cleaning produces expected outcomes
@@ -1,16 +1,26 @@
 """
 Script to clean and transform all the data from the extract script.
 """
+import re
+
 import pandas as pd
 import spacy
+from spacy.tokens import Doc
+
+from cache import TagCache
 
 DNB = ['Drum & Bass', 'Dnb', 'Drum N Bass']
 RNB = ['Rnb', 'R&B']
 FEATURING = ["ft.", "featuring"]
 VARIOUS = ["various artists", "various", "various artist",
            "vaarious"]
-NLP_MODEL = spacy.load("en_core_web_sm")
-EXTENDED_ASCII_RANGE = 255
+# only the named entity recogniser is needed; in en_core_web_sm it has its own tok2vec layer
+NLP_MODEL = spacy.load("en_core_web_sm",
+                       exclude=["tok2vec", "tagger", "parser", "senter",
+                                "attribute_ruler", "lemmatizer"])
+NLP_BATCH_SIZE = 256
+SPECIAL_CHARACTERS = re.compile(r"[^\x00-\xff]")
+TAG_CACHE = TagCache()
 
 
 def convert_to_df(extracted_data: list[dict]):
@@ -24,50 +34,79 @@ def has_special_characters(name: str) -> bool:
     """
     If a given name has any special characters outside English, then return True
     """
-    for character in name:
-        if ord(character) > EXTENDED_ASCII_RANGE:
-            return True
-    return False
+    return SPECIAL_CHARACTERS.search(name) is not None
 
 
-def clean_tags(tags: list[str]) -> list[str]:
+def clean_tag(tag: str, doc: Doc) -> list[str]:
     """
-    Cleans the tags associated with the album / track.
+    Cleans a single tag, given the tag run through the NLP model, returning the genres
+    it stands for. Returns an empty list if the tag is dropped, e.g. because it names
+    a place or person.
+    """
+    for ent in doc.ents:
+        if ent.label_ in ("GPE", "PERSON"):
+            return []
+    if tag == "":
+        return []
+    if has_special_characters(tag):
+        return []
+    if '/' in tag:
+        return [extra_tag.title() for extra_tag in tag.split('/')]
+    if '-' in tag:
+        tag = tag.replace('-', ' ')
+    if tag[-1] == '.':
+        tag = tag[:-1]
+    if tag.title() in DNB:
+        return ['DNB']
+    if tag.title() in RNB:
+        return ['R&B']
+    return [tag.title()]
+
+
+def get_cleaned_tags(tags: list[str], tag_cache: TagCache = TAG_CACHE) -> dict:
+    """
+    Returns a dictionary of the cleaned tags for every unique tag given.
+    Tags that have been cleaned before are looked up in the tag cache,
+    the rest are run through the NLP model together in batches.
+    """
+    cleaned = {}
+    new_tags = []
+    for tag in dict.fromkeys(tags):
+        cached = tag_cache.get(tag)
+        if cached is None:
+            new_tags.append(tag)
+        else:
+            cleaned[tag] = cached
+
+    for tag, doc in zip(new_tags, NLP_MODEL.pipe(new_tags, batch_size=NLP_BATCH_SIZE)):
+        cleaned[tag] = clean_tag(tag, doc)
+        tag_cache.set(tag, cleaned[tag])
+
+    return cleaned
+
+
+def merge_cleaned_tags(tags: list[str], cleaned: dict) -> list[str]:
+    """
+    Combines the cleaned versions of the tags associated with the album / track.
     """
-    if not tags:
-        return ["Other"]
     tags_set = set()
     for tag in tags:
-        doc = NLP_MODEL(tag)
-        for ent in doc.ents:
-            if ent.label_ in ("GPE", "PERSON"):
-                break
-        else:
-            if tag == "":
-                continue
-            if has_special_characters(tag):
-                continue
-            if '/' in tag:
-                tags = tag.split('/')
-                for extra_tag in tags:
-                    tags_set.add(extra_tag.title())
-                continue
-            if '-' in tag:
-                tag = tag.replace('-', ' ')
-            if tag[-1] == '.':
-                tag = tag[:-1]
-            if tag.title() in DNB:
-                tags_set.add('DNB')
-            elif tag.title() in RNB:
-                tags_set.add('R&B')
-            else:
-                tags_set.add(tag.title())
+        tags_set.update(cleaned[tag])
     new_tags = list(tags_set)
     if new_tags:
         return new_tags
     return ["Other"]
 
 
+def clean_tags(tags: list[str], tag_cache: TagCache = TAG_CACHE) -> list[str]:
+    """
+    Cleans the tags associated with the album / track.
+    """
+    if not tags:
+        return ["Other"]
+    return merge_cleaned_tags(tags, get_cleaned_tags(tags, tag_cache))
+
+
 def clean_artists(name: str) -> str:
     """
     For artist names that feature other artists,
@@ -99,19 +138,46 @@ def clean_titles(name: str) -> str:
     return name.strip()
 
 
-def clean_dataframe(dataframe: pd.DataFrame) -> tuple:
+def clean_artists_column(artists: pd.Series) -> pd.Series:
+    """
+    Vectorised version of clean_artists for a whole column of artist names.
+    """
+    has_featuring = pd.Series(False, index=artists.index)
+    cleaned = artists
+    for word in FEATURING:
+        features = ~has_featuring & artists.str.contains(word, regex=False)
+        cleaned = cleaned.mask(
+            features, artists.str.split(f" {word}", n=1, regex=False).str[0])
+        has_featuring |= features
+
+    dropped = artists.str.contains(SPECIAL_CHARACTERS) | artists.str.lower().isin(VARIOUS)
+    return cleaned.mask(dropped)
+
+
+def clean_titles_column(titles: pd.Series) -> pd.Series:
+    """
+    Vectorised version of clean_titles for a whole column of titles.
+    """
+    dropped = titles.str.contains(SPECIAL_CHARACTERS) | (titles.str.lower() == "untitled")
+    return titles.str.strip().mask(dropped)
+
+
+def clean_dataframe(dataframe: pd.DataFrame, tag_cache: TagCache = TAG_CACHE) -> tuple:
     """
     Cleans the tags, the title, the amount paid for the album / track
     and the artist.
     """
-    dataframe['tags'] = dataframe['tags'].apply(clean_tags)
+    cleaned_tags = get_cleaned_tags(
+        [tag for tags in dataframe['tags'] for tag in tags], tag_cache)
+    dataframe['tags'] = dataframe['tags'].apply(
+        merge_cleaned_tags, cleaned=cleaned_tags)
 
-    dataframe['title'] = dataframe['title'].apply(clean_titles)
+    dataframe['title'] = clean_titles_column(dataframe['title'])
 
     dataframe['amount_paid_usd'] = dataframe['amount_paid_usd'] * 100
     dataframe['amount_paid_usd'] = dataframe['amount_paid_usd'].astype(int)
 
-    dataframe['artist'] = dataframe['artist'].apply(clean_artists)
+    dataframe['artist'] = clean_artists_column(dataframe['artist'])
 
     dataframe = dataframe.dropna()
 
@@ -0,0 +1,60 @@
+"""
+Script that benchmarks each available pdf renderer on the report for a date,
+and how long each section of the report takes to make.
+"""
+
+from argparse import ArgumentParser
+from datetime import date
+from statistics import mean
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from os import path
+
+from dotenv import load_dotenv
+
+from renderers import get_available_renderers, get_renderer
+from report import get_db_connection, generate_html_string, get_yesterday, print_timings
+
+
+def benchmark_renderer(renderer: str, source_html: str, repeats: int) -> list[float]:
+    """
+    Returns the seconds taken by each of the given number of renders of the html.
+    """
+    render = get_renderer(renderer)
+    seconds = []
+
+    with TemporaryDirectory() as directory:
+        output_filename = path.join(directory, f"{renderer}.pdf")
+        for _ in range(repeats):
+            start = perf_counter()
+            render(source_html, output_filename)
+            seconds.append(perf_counter() - start)
+
+    return seconds
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Benchmarks the pdf renderers on a daily report.")
+    parser.add_argument("--date", type=date.fromisoformat, default=None,
+                        help="date of the report, YYYY-MM-DD (default: yesterday)")
+    parser.add_argument("--html", default=None,
+                        help="render this html file instead of querying the database")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="number of times to render with each renderer")
+    args = parser.parse_args()
+
+    if args.html is not None:
+        with open(args.html, encoding="utf_8") as html_file:
+            html_report = html_file.read()
+    else:
+        load_dotenv()
+        connection = get_db_connection()
+        timings = {}
+        html_report = generate_html_string(connection, args.date or get_yesterday(), timings)
+        connection.close()
+        print_timings(timings)
+
+    for name in get_available_renderers():
+        renders = benchmark_renderer(name, html_report, args.repeats)
+        print(f"{name}: mean {mean(renders):.3f}s, min {min(renders):.3f}s "
+              f"over {args.repeats} renders")
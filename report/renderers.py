@@ -0,0 +1,69 @@
+"""
+Script which converts the report html into a pdf. Each renderer is a function that
+takes the html and the path of the pdf and returns the number of errors, so the
+renderer used can be chosen with the PDF_RENDERER environment variable.
+"""
+
+from xhtml2pdf import pisa, default as xhtml2pdf_default
+
+try:
+    from weasyprint import HTML
+    from weasyprint.text.fonts import FontConfiguration
+except (ImportError, OSError):
+    # WeasyPrint is optional and needs Pango installed on the system
+    HTML = None
+
+DEFAULT_RENDERER = "xhtml2pdf"
+FONT_CONFIG = None
+
+# The stylesheet asks for Open Sans, which xhtml2pdf doesn't have, so it is mapped once
+# to the Helvetica that xhtml2pdf would otherwise fall back to, with a warning, on every render
+xhtml2pdf_default.DEFAULT_FONT.setdefault("open sans", "Helvetica")
+
+
+def render_with_xhtml2pdf(source_html: str, output_filename: str) -> int:
+    """
+    Converts a html string into a pdf with xhtml2pdf.
+    """
+    with open(output_filename, "w+b") as result_file:
+        pisa_status = pisa.CreatePDF(source_html, dest=result_file)
+
+    return pisa_status.err
+
+
+def render_with_weasyprint(source_html: str, output_filename: str) -> int:
+    """
+    Converts a html string into a pdf with WeasyPrint. The fonts are
+    loaded on the first render and kept for as long as the container is warm.
+    """
+    global FONT_CONFIG  # pylint: disable=global-statement
+
+    if FONT_CONFIG is None:
+        FONT_CONFIG = FontConfiguration()
+
+    HTML(string=source_html).write_pdf(output_filename, font_config=FONT_CONFIG)
+
+    return 0
+
+
+RENDERERS = {
+    "xhtml2pdf": render_with_xhtml2pdf,
+    "weasyprint": render_with_weasyprint,
+}
+
+
+def get_available_renderers() -> list[str]:
+    """
+    Returns the names of the renderers whose libraries are installed.
+    """
+    return [name for name in RENDERERS if name != "weasyprint" or HTML is not None]
+
+
+def get_renderer(name: str = DEFAULT_RENDERER):
+    """
+    Returns the renderer with the given name.
+    """
+    if name not in get_available_renderers():
+        raise ValueError(f"Unknown or unavailable pdf renderer: {name}")
+
+    return RENDERERS[name]
@@ -1,22 +1,60 @@
-"""Script that creates a pdf daily report for the previous days sales data"""
-
-from os import environ
-from datetime import datetime, timedelta
+"""
+Script that creates a pdf daily report for the previous days sales data,
+or for any date, and can backfill the reports for a range of dates
+"""
+
+from argparse import ArgumentParser
+from base64 import b64encode
+from os import environ, path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, time, timedelta
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
+from itertools import chain
+from zoneinfo import ZoneInfo
 
-from time import perf_counter
+from threading import Lock
+from time import monotonic, perf_counter, sleep
+from typing import Optional
 from dotenv import load_dotenv
-from psycopg2 import extensions, connect
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from psycopg2 import extensions, connect, Error, InterfaceError, OperationalError
+from psycopg2.pool import ThreadedConnectionPool
 import pandas as pd
 import boto3
-from botocore.exceptions import ClientError
-from xhtml2pdf import pisa
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+from renderers import get_renderer, DEFAULT_RENDERER
 
 
 # pylint: disable=E1136
 
-YESTERDAY_DATE = datetime.strftime(datetime.now() - timedelta(1), '%d-%m-%Y')
+REPORT_TIMEZONE = ZoneInfo("UTC")
+
+POOL_SIZE = 2
+CONNECTION_POOL = None
+
+BASE_DIR = path.dirname(path.abspath(__file__))
+
+with open(path.join(BASE_DIR, "static", "style.css"), encoding="utf_8") as stylesheet_file:
+    STYLESHEET = stylesheet_file.read()
+with open(path.join(BASE_DIR, "bandcamp_logo.jpeg"), "rb") as logo_file:
+    LOGO = "data:image/jpeg;base64," + b64encode(logo_file.read()).decode()
+
+TEMPLATES = Environment(
+    loader=FileSystemLoader(path.join(BASE_DIR, "templates")),
+    autoescape=select_autoescape(), trim_blocks=True, lstrip_blocks=True)
+TEMPLATES.globals.update(stylesheet=STYLESHEET, logo=LOGO)
+REPORT_TEMPLATE = TEMPLATES.get_template("report.html")
+
+SENDER_EMAIL = 'trainee.ishika.madhav@sigmalabs.co.uk'
+EMAIL_WORKERS = 8
+DEFAULT_SEND_RATE = 1
+SES_CLIENT = None
+
+ALBUM_TYPE_ID = 1
+TRACK_TYPE_ID = 2
 
 
 def get_db_connection() -> extensions.connection:
@@ -33,793 +71,644 @@ def get_db_connection() -> extensions.connection:
         return None
 
 
-def create_table_two_columns(column_1: str, column_2: str, data: list[dict],
-                             key: str, value: str) -> str:
+def get_connection_pool() -> ThreadedConnectionPool:
     """
-    Returns a html string of a table that contains two columns
+    Returns a pool of connections to the AWS Bandcamp database, created on first use
+    and kept for as long as the lambda container is warm
     """
-    html_string = f"<table><tr><th> {column_1} </th><th> {column_2}</th>"
-
-    if column_2 == 'Revenue':
-        for item in data:
-            html_string += f"""
-            <tr>
-            <td>{item[f'{key}']}</td>
-            <td>${item[f'{value}']}</td>
-            </tr>"""
+    global CONNECTION_POOL  # pylint: disable=global-statement
 
-    else:
-        for item in data:
-            html_string += f"""
-            <tr>
-            <td>{item[f'{key}']}</td>
-            <td>{item[f'{value}']}</td>
-            </tr>"""
+    if CONNECTION_POOL is None or CONNECTION_POOL.closed:
+        CONNECTION_POOL = ThreadedConnectionPool(1, POOL_SIZE,
+                                                 user=environ["DB_USER"],
+                                                 password=environ["DB_PASSWORD"],
+                                                 host=environ["DB_IP"],
+                                                 port=environ["DB_PORT"],
+                                                 database=environ["DB_NAME"])
+    return CONNECTION_POOL
 
-    html_string += "</table>"
 
-    return html_string
-
-
-def create_table_three_columns(column_1: str, column_2: str, column_3: str, data: list[dict],
-                               key: str, value: str, value_2: str) -> str:
+def get_live_connection(pool: ThreadedConnectionPool) -> extensions.connection:
     """
-    Returns a html string of a table that contains three columns
+    Returns a connection from the pool that the database still answers on.
+    Connections dropped while the lambda container was idle are closed and replaced,
+    so every pooled connection can be stale before a fresh one is opened.
     """
-    html_string = f"<table><tr><th> {column_1} </th><th> {column_2}</th><th> {column_3}</th>"
-
-    for item in data:
-        html_string += f"""
-        <tr>
-        <td>{item[f'{key}']}</td>
-        <td>{item[f'{value}']}</td>
-        <td>{item[f'{value_2}']}</td>
-        </tr>"""
-
-    html_string += "</table>"
+    for _ in range(POOL_SIZE):
+        db_connection = pool.getconn()
+        try:
+            with db_connection.cursor() as curr:
+                curr.execute("SELECT 1;")
+            db_connection.rollback()
+            return db_connection
+        except (InterfaceError, OperationalError):
+            pool.putconn(db_connection, close=True)
 
-    return html_string
+    return pool.getconn()
 
 
-def format_all_numbers(dictionaries: list[dict], key: str):
+def run_with_connection(pool: ThreadedConnectionPool, function, *args):
     """
-    Formats numbers so that commas will be inserted where necessary
-    e.g 1000 = 1,000
+    Runs the function with a live connection from the pool as its first argument and
+    returns its result. The connection always goes back to the pool, but one that
+    fails with a database error is closed instead of being reused.
     """
-    for dict in dictionaries:
-        dict[f'{key}'] = '{:,}'.format(dict[f'{key}'])
+    db_connection = get_live_connection(pool)
+    close = False
+    try:
+        return function(db_connection, *args)
+    except Error:
+        close = True
+        raise
+    finally:
+        pool.putconn(db_connection, close=close)
 
 
-def load_sale_event_data(db_connection: extensions.connection) -> pd.DataFrame:
-    """
-    Loads all sale event data from the database into a pandas dataframe
-    """
+def get_yesterday() -> date:
+    """Returns the date of the previous day in the report's timezone"""
 
-    with db_connection.cursor() as curr:
+    return datetime.now(REPORT_TIMEZONE).date() - timedelta(days=1)
 
-        curr.execute("""
-                    SELECT sale_id, amount, item_id, country_id
-                    FROM sale_event
-                    WHERE DATE(sale_time) = CURRENT_DATE - INTERVAL '1 day';""")
-        tuples = curr.fetchall()
-        column_names = ['sale_id', 'amount', 'item_id',
-                        'country_id']
 
-        df = pd.DataFrame(tuples, columns=column_names)
+def get_report_dates(start_date: date, end_date: date) -> list[date]:
+    """Returns every date from the start date to the end date"""
 
-        return df
+    if end_date < start_date:
+        raise ValueError("The end date is before the start date")
+
+    return [start_date + timedelta(days=day)
+            for day in range((end_date - start_date).days + 1)]
 
 
-def get_key_analytics(db_connection: extensions.connection) -> str:
+def get_day_bounds(report_date: date) -> tuple[datetime, datetime]:
     """
-    Returns a html string of a table that contains information on
-    the amount of sales and income.
+    Returns the start of the report date and the start of the following day
+    in the report's timezone, so sales on the date are start <= sale_time < end
     """
+    start = datetime.combine(report_date, time(), tzinfo=REPORT_TIMEZONE)
 
-    sale_event_data = load_sale_event_data(db_connection)
-    # amount number of sales
-    amount_sales = ('{:,}'.format(sale_event_data['sale_id'].nunique()))
-
-    # amount income
-    amount_income = ('{:,}'.format((sale_event_data['amount'].sum())/100))
-
-    html_string = f"""<table class="center">
-            <tr>
-            <th> Total Items Sold</th>
-            <th>Total Income</th>
-            </tr>
-            <tr>
-        <td>{amount_sales}</td>
-            <td>${amount_income}</td>
-        </tr>
-    </table>"""
-
-    return html_string
+    return start, start + timedelta(days=1)
 
 
-def load_top_5_popular_artist_data(db_connection: extensions.connection) -> pd.DataFrame:
+def format_all_numbers(dictionaries: list[dict], key: str):
     """
-    Loads the top 5 artists that appear the most in the database into a pandas dataframe
+    Formats numbers so that commas will be inserted where necessary
+    e.g 1000 = 1,000
     """
-
-    with db_connection.cursor() as curr:
-
-        curr.execute("""
-                    SELECT COUNT(sale_event.sale_id) AS count, artist.artist_name
-                    FROM sale_event
-                    JOIN item
-                    ON item.item_id = sale_event.item_id
-                    JOIN artist
-                    ON artist.artist_id = item.artist_id
-                    WHERE DATE(sale_time) = CURRENT_DATE - INTERVAL '1 day'
-                    GROUP BY artist.artist_name
-                    ORDER BY count DESC
-                    LIMIT 5;""")
-        tuples = curr.fetchall()
-        column_names = ['count',
-                        'artist']
-
-        df = pd.DataFrame(tuples, columns=column_names)
-
-        return df
+    for dict in dictionaries:
+        dict[f'{key}'] = '{:,}'.format(dict[f'{key}'])
 
 
-def load_top_5_grossing_artist_data(db_connection: extensions.connection) -> pd.DataFrame:
+def load_sales_data(db_connection: extensions.connection, start_date: date,
+                    end_date: Optional[date] = None) -> pd.DataFrame:
     """
-    Loads the top 5 artists that have made the most money from the database into a pandas dataframe
+    Loads every sale made from the start date to the end date, or only on the start date,
+    joined to its item, artist, country and the genres of its item, from the database
+    into a pandas dataframe, with the date of each sale in the report's timezone.
+    Every section of a report is computed from this one dataframe.
     """
+    start, _ = get_day_bounds(start_date)
+    _, end = get_day_bounds(end_date or start_date)
 
     with db_connection.cursor() as curr:
 
         curr.execute("""
-                    SELECT SUM(sale_event.amount) AS amount, artist.artist_name
-                    FROM sale_event
+                    WITH day_sale AS (
+                        SELECT sale_id, amount, item_id, country_id,
+                            (sale_time AT TIME ZONE %(timezone)s)::DATE AS sale_date
+                        FROM sale_event
+                        WHERE sale_time >= %(start)s
+                        AND sale_time < %(end)s
+                    ),
+                    item_genres AS (
+                        SELECT item_genre.item_id, array_agg(DISTINCT genre.genre) AS genres
+                        FROM item_genre
+                        JOIN genre
+                        ON genre.genre_id = item_genre.genre_id
+                        WHERE item_genre.item_id IN (SELECT item_id FROM day_sale)
+                        GROUP BY item_genre.item_id
+                    )
+                    SELECT day_sale.sale_id, day_sale.sale_date, day_sale.amount,
+                        item.item_name, item.item_type_id, artist.artist_name, country.country,
+                        COALESCE(item_genres.genres, '{}')
+                    FROM day_sale
                     JOIN item
-                    ON item.item_id = sale_event.item_id
+                    ON item.item_id = day_sale.item_id
                     JOIN artist
                     ON artist.artist_id = item.artist_id
-                    WHERE DATE(sale_time) = CURRENT_DATE - INTERVAL '1 day'
-                    GROUP BY artist.artist_name
-                    ORDER BY amount DESC
-                    LIMIT 5;""")
+                    JOIN country
+                    ON country.country_id = day_sale.country_id
+                    LEFT JOIN item_genres
+                    ON item_genres.item_id = day_sale.item_id;""",
+                     {"timezone": str(REPORT_TIMEZONE), "start": start, "end": end})
         tuples = curr.fetchall()
-        column_names = ['amount',
-                        'artist']
+        column_names = ['sale_id', 'sale_date', 'amount', 'item_name', 'item_type_id',
+                        'artist', 'country', 'genres']
 
         df = pd.DataFrame(tuples, columns=column_names)
 
         return df
 
 
-def get_top_5_popular_artists(db_connection: extensions.connection) -> str:
+def get_top_5_by_count(sales: pd.DataFrame, column: str) -> pd.DataFrame:
     """
-    Returns a html string of a table that contains information on
-    the top 5 most popular artists and how many items they sold
+    Returns the 5 values of the column that appear in the most sales, and how many sales
     """
+    counts = sales.groupby(column).size().sort_values(ascending=False, kind='stable')
 
-    artist_data = load_top_5_popular_artist_data(db_connection)
+    return counts.head(5).reset_index(name='count')
 
-    artists = artist_data.to_dict('records')
 
-    format_all_numbers(artists, 'count')
+def get_top_5_by_revenue(sales: pd.DataFrame, column: str) -> pd.DataFrame:
+    """
+    Returns the 5 values of the column that have made the most money, and how much in dollars
+    """
+    amounts = sales.groupby(column)['amount'].sum().sort_values(
+        ascending=False, kind='stable')
 
-    html_string = create_table_two_columns(
-        'Artist', 'Albums/Tracks Sold', artists, 'artist', 'count')
+    top_5 = amounts.head(5).reset_index(name='amount')
+    top_5['amount'] = top_5['amount']/100
 
-    return html_string
+    return top_5
 
 
-def get_top_5_grossing_artists(db_connection: extensions.connection) -> str:
+def get_key_analytics(sales: pd.DataFrame) -> dict:
     """
-    Returns a html string of a table that contains information on
-    the top 5 grossing artists and their total revenue
+    Returns the amount of sales and income.
     """
 
-    artist_data = load_top_5_grossing_artist_data(db_connection)
-
-    artist_data['amount'] = (
-        artist_data['amount']/100)
-
-    artists = artist_data.to_dict('records')
-
-    format_all_numbers(artists, 'amount')
+    # amount number of sales
+    amount_sales = ('{:,}'.format(sales['sale_id'].nunique()))
 
-    html_string = create_table_two_columns(
-        'Artist', 'Revenue', artists, 'artist', 'amount')
+    # amount income
+    amount_income = ('{:,}'.format((sales['amount'].sum())/100))
 
-    return html_string
+    return {'sales': amount_sales, 'income': amount_income}
 
 
-def load_album_data(db_connection: extensions.connection) -> pd.DataFrame:
+def get_top_5_popular_artists(sales: pd.DataFrame) -> list[dict]:
     """
-    Loads the top 5 albums that have sold the most copies from the database into a pandas dataframe
+    Returns the top 5 most popular artists and how many items they sold
     """
 
-    with db_connection.cursor() as curr:
+    artists = get_top_5_by_count(sales, 'artist').to_dict('records')
 
-        curr.execute("""
-                    SELECT COUNT(sale_event.sale_id) as count, item.item_name
-                    FROM sale_event
-                    JOIN item
-                    ON item.item_id = sale_event.item_id
-                    JOIN item_type
-                    ON item_type.item_type_id = item.item_type_id
-                    WHERE DATE(sale_time) = CURRENT_DATE - INTERVAL '1 day'
-                    AND item_type.item_type_id = 1
-                    GROUP BY item.item_name
-                    ORDER BY count DESC
-                    LIMIT 5;""")
-        tuples = curr.fetchall()
-        column_names = ['count', 'item_name']
+    format_all_numbers(artists, 'count')
 
-        df = pd.DataFrame(tuples, columns=column_names)
+    return artists
 
-        return df
 
-
-def load_track_data(db_connection: extensions.connection) -> pd.DataFrame:
+def get_top_5_grossing_artists(sales: pd.DataFrame) -> list[dict]:
     """
-    Loads the top 5 tracks that have sold the most copies from the database into a pandas dataframe
+    Returns the top 5 grossing artists and their total revenue
     """
 
-    with db_connection.cursor() as curr:
+    artists = get_top_5_by_revenue(sales, 'artist').to_dict('records')
 
-        curr.execute("""
-                    SELECT COUNT(sale_event.sale_id) as count, item.item_name
-                    FROM sale_event
-                    JOIN item
-                    ON item.item_id = sale_event.item_id
-                    JOIN item_type
-                    ON item_type.item_type_id = item.item_type_id
-                    WHERE DATE(sale_time) = CURRENT_DATE - INTERVAL '1 day'
-                    AND item_type.item_type_id = 2
-                    GROUP BY item.item_name
-                    ORDER BY count DESC
-                    LIMIT 5;""")
-        tuples = curr.fetchall()
-        column_names = ['count', 'item_name']
-
-        df = pd.DataFrame(tuples, columns=column_names)
+    format_all_numbers(artists, 'amount')
 
-        return df
+    return artists
 
 
-def get_top_5_sold_albums(db_connection: extensions.connection) -> str:
+def get_top_5_sold_albums(sales: pd.DataFrame) -> list[dict]:
     """
-    Returns a html string of a table that contains information on
-    the top 5 sold albums and how many copies they sold
+    Returns the top 5 sold albums and how many copies they sold
     """
-    album_data = load_album_data(db_connection)
-
-    albums = album_data.to_dict('records')
+    albums = get_top_5_by_count(
+        sales[sales['item_type_id'] == ALBUM_TYPE_ID], 'item_name').to_dict('records')
 
     format_all_numbers(albums, 'count')
 
-    html_string = create_table_two_columns(
-        'Album', 'Copies Sold', albums, 'item_name', 'count')
-
-    return html_string
+    return albums
 
 
-def get_top_5_sold_tracks(db_connection: extensions.connection) -> str:
+def get_top_5_sold_tracks(sales: pd.DataFrame) -> list[dict]:
     """
-    Returns a html string of a table that contains information on
-    the top 5 sold tracks and how many copies they sold
+    Returns the top 5 sold tracks and how many copies they sold
     """
-    track_data = load_track_data(db_connection)
-
-    tracks = track_data.to_dict('records')
+    tracks = get_top_5_by_count(
+        sales[sales['item_type_id'] == TRACK_TYPE_ID], 'item_name').to_dict('records')
 
     format_all_numbers(tracks, 'count')
 
-    html_string = create_table_two_columns(
-        'Tracks', 'Copies Sold', tracks, 'item_name', 'count')
-
-    return html_string
+    return tracks
 
 
-def load_album_revenue_data(db_connection: extensions.connection) -> pd.DataFrame:
+def get_top_5_grossing_albums(sales: pd.DataFrame) -> list[dict]:
     """
-    Loads the top 5 albums that have made the most money from the database into a pandas dataframe
+    Returns the top 5 sold albums and their revenue
     """
+    albums = get_top_5_by_revenue(
+        sales[sales['item_type_id'] == ALBUM_TYPE_ID], 'item_name').to_dict('records')
 
-    with db_connection.cursor() as curr:
-
-        curr.execute("""
-                    SELECT SUM(sale_event.amount) as amount, item.item_name
-                    FROM sale_event
-                    JOIN item
-                    ON item.item_id = sale_event.item_id
-                    JOIN item_type
-                    ON item_type.item_type_id = item.item_type_id
-                    WHERE DATE(sale_time) = CURRENT_DATE - INTERVAL '1 day'
-                    AND item_type.item_type_id = 1
-                    GROUP BY item.item_name
-                    ORDER BY amount DESC
-                    LIMIT 5;""")
-        tuples = curr.fetchall()
-        column_names = ['amount', 'item_name']
+    format_all_numbers(albums, 'amount')
 
-        df = pd.DataFrame(tuples, columns=column_names)
+    return albums
 
-        return df
 
-
-def load_track_revenue_data(db_connection: extensions.connection) -> pd.DataFrame:
+def get_top_5_grossing_tracks(sales: pd.DataFrame) -> list[dict]:
     """
-    Loads the top 5 tracks that have made the most money from the database into a pandas dataframe
+    Returns the top 5 sold tracks and their revenue
     """
+    tracks = get_top_5_by_revenue(
+        sales[sales['item_type_id'] == TRACK_TYPE_ID], 'item_name').to_dict('records')
 
-    with db_connection.cursor() as curr:
-
-        curr.execute("""
-                    SELECT SUM(sale_event.amount) as amount, item.item_name
-                    FROM sale_event
-                    JOIN item
-                    ON item.item_id = sale_event.item_id
-                    JOIN item_type
-                    ON item_type.item_type_id = item.item_type_id
-                    WHERE DATE(sale_time) = CURRENT_DATE - INTERVAL '1 day'
-                    AND item_type.item_type_id = 2
-                    GROUP BY item.item_name
-                    ORDER BY amount DESC
-                    LIMIT 5;""")
-        tuples = curr.fetchall()
-        column_names = ['amount', 'item_name']
-
-        df = pd.DataFrame(tuples, columns=column_names)
+    format_all_numbers(tracks, 'amount')
 
-        return df
+    return tracks
 
 
-def get_top_5_grossing_albums(db_connection: extensions.connection) -> str:
+def get_top_5_items_with_genres(sales: pd.DataFrame, item_type_id: int) -> list[dict]:
     """
-    Returns a html string of a table that contains information on
-    the top 5 sold albums and their revenue
+    Returns the top 5 sold items of the type that have genres, how many copies
+    they sold and up to 3 of their genres
     """
-    album_data = load_album_revenue_data(db_connection)
+    items = sales[(sales['item_type_id'] == item_type_id)
+                  & (sales['genres'].str.len() > 0)]
 
-    album_data['amount'] = (
-        album_data['amount']/100)
-
-    albums = album_data.to_dict('records')
-
-    format_all_numbers(albums, 'amount')
+    top_5 = get_top_5_by_count(items, 'item_name')
 
-    html_string = create_table_two_columns(
-        'Album', 'Revenue', albums, 'item_name', 'amount')
+    item_genres = items.groupby('item_name')['genres'].agg(
+        lambda x: sorted(set(chain.from_iterable(x)))[:3])
+    top_5['genre'] = top_5['item_name'].map(item_genres)
 
-    return html_string
+    return top_5.to_dict('records')
 
 
-def get_top_5_grossing_tracks(db_connection: extensions.connection) -> str:
+def get_album_genres(sales: pd.DataFrame) -> list[dict]:
     """
-    Returns a html string of a table that contains information on
-    the top 5 sold tracks and their revenue
+    Returns the top 5 sold albums and how many copies they sold and their associated genres
     """
-    track_data = load_track_revenue_data(db_connection)
-
-    track_data['amount'] = (
-        track_data['amount']/100)
 
-    tracks = track_data.to_dict('records')
-
-    format_all_numbers(tracks, 'amount')
+    final = get_top_5_items_with_genres(sales, ALBUM_TYPE_ID)
 
-    html_string = create_table_two_columns(
-        'Tracks', 'Revenue', tracks, 'item_name', 'amount')
+    format_all_numbers(final, 'count')
 
-    return html_string
+    return final
 
 
-def load_album_genre_data(db_connection: extensions.connection) -> pd.DataFrame:
+def get_track_genres(sales: pd.DataFrame) -> list[dict]:
     """
-    Loads album data that also contains information about each genre associated
-    with the album from the database and converts it to a pandas dataframe
+    Returns the top 5 sold tracks and how many copies they sold and their associated genres
     """
+    final = get_top_5_items_with_genres(sales, TRACK_TYPE_ID)
 
-    with db_connection.cursor() as curr:
-
-        curr.execute("""
-                    SELECT COUNT(sale_event.sale_id) as count, item.item_name, genre.genre
-                    FROM sale_event
-                    JOIN item
-                    ON item.item_id = sale_event.item_id
-                    JOIN item_type
-                    ON item_type.item_type_id = item.item_type_id
-                    JOIN item_genre
-                    ON item_genre.item_id = item.item_id
-                    JOIN genre
-                    ON genre.genre_id = item_genre.genre_id
-                    WHERE DATE(sale_time) = CURRENT_DATE - INTERVAL '1 day'
-                    AND item_type.item_type_id = 1
-                    GROUP BY item.item_name, genre.genre
-                    ORDER BY count DESC;""")
-        tuples = curr.fetchall()
-        column_names = ['count', 'item_name', 'genre']
+    format_all_numbers(final, 'count')
 
-        df = pd.DataFrame(tuples, columns=column_names)
+    return final
 
-        return df
 
-
-def load_track_genre_data(db_connection: extensions.connection) -> pd.DataFrame:
+def get_popular_genre(sales: pd.DataFrame) -> list[dict]:
     """
-    Loads track data that also contains information about each genre associated
-    with the track from the database and converts it to a pandas dataframe
+    Returns the top 5 genres and how many copies a genre has sold
     """
+    genres = get_top_5_by_count(
+        sales.explode('genres').dropna(subset='genres'), 'genres').to_dict('records')
 
-    with db_connection.cursor() as curr:
-
-        curr.execute("""
-                    SELECT COUNT(sale_event.sale_id) as count, item.item_name, genre.genre
-                    FROM sale_event
-                    JOIN item
-                    ON item.item_id = sale_event.item_id
-                    JOIN item_type
-                    ON item_type.item_type_id = item.item_type_id
-                    JOIN item_genre
-                    ON item_genre.item_id = item.item_id
-                    JOIN genre
-                    ON genre.genre_id = item_genre.genre_id
-                    WHERE DATE(sale_time) = CURRENT_DATE - INTERVAL '1 day'
-                    AND item_type.item_type_id = 2
-                    GROUP BY item.item_name, genre.genre
-                    ORDER BY count DESC;""")
-        tuples = curr.fetchall()
-        column_names = ['count', 'item_name', 'genre']
-
-        df = pd.DataFrame(tuples, columns=column_names)
+    format_all_numbers(genres, 'count')
 
-        return df
+    return genres
 
 
-def get_album_genres(db_connection: extensions.connection) -> str:
+def get_countries_insights(sales: pd.DataFrame) -> list[dict]:
     """
-    Returns a html string of a table that contains information on
-    the top 5 sold albums and how many copies they sold and their associated genres
+    Returns how many sales have occurred in every country and who the countries top artist is
     """
+    country_sales = sales.groupby('country').size().sort_values(
+        ascending=False, kind='stable').head(10).reset_index(name='count')
 
-    album_data = load_album_genre_data(db_connection)
-
-    albums_genre = album_data.groupby(['item_name'])[
-        'genre'].agg(list).reset_index()
-
-    albums_genre['genre'] = albums_genre['genre'].apply(
-        lambda x: list(set(x))[:3])
-
-    album_data = album_data.drop('genre', axis=1)
+    most_popular_artists = sales.groupby('country')['artist'].agg(
+        lambda x: x.value_counts().idxmax())
+    country_sales['artist'] = country_sales['country'].map(most_popular_artists)
 
-    final = pd.merge(album_data, albums_genre).drop_duplicates(
-        subset='item_name', keep='first').head(5).to_dict('records')
+    final = country_sales.to_dict('records')
 
     format_all_numbers(final, 'count')
 
-    html_string = create_table_three_columns(
-        'Album', 'Copies Sold', 'Genres', final, 'item_name', 'count', 'genre')
+    return final
 
-    return html_string
+
+SECTIONS = {
+    "key_analytics": get_key_analytics,
+    "top_5_popular_artists": get_top_5_popular_artists,
+    "top_5_grossing_artists": get_top_5_grossing_artists,
+    "top_5_sold_albums": get_top_5_sold_albums,
+    "top_5_grossing_albums": get_top_5_grossing_albums,
+    "top_5_sold_tracks": get_top_5_sold_tracks,
+    "top_5_grossing_tracks": get_top_5_grossing_tracks,
+    "popular_genre": get_popular_genre,
+    "album_genres": get_album_genres,
+    "track_genres": get_track_genres,
+    "countries_insights": get_countries_insights,
+}
 
 
-def get_track_genres(db_connection: extensions.connection) -> pd.DataFrame:
+def build_sections(sales: pd.DataFrame, timings: Optional[dict] = None) -> dict:
     """
-    Returns a html string of a table that contains information on
-    the top 5 sold tracks and how many copies they sold and their associated genres
+    Returns the data shown in every section of the report, keyed by section name.
+    The sections are computed from the sales dataframe, so none of them use the database.
+    If a timings dictionary is given, the seconds taken by each section are added to it.
     """
-    track_data = load_track_genre_data(db_connection)
+    sections = {}
+    for name, get_section in SECTIONS.items():
+        start = perf_counter()
+        sections[name] = get_section(sales)
+        if timings is not None:
+            timings[name] = perf_counter() - start
 
-    track_genre = track_data.groupby(['item_name'])[
-        'genre'].agg(list).reset_index()
+    return sections
 
-    track_genre['genre'] = track_genre['genre'].apply(
-        lambda x: list(set(x))[:3])
 
-    track_data = track_data.drop('genre', axis=1)
+def print_timings(timings: dict) -> None:
+    """
+    Prints how many seconds each step of making the report took.
+    """
+    for name, seconds in timings.items():
+        print(f"{name}: {seconds:.4f}s")
 
-    final = pd.merge(track_data, track_genre).drop_duplicates(
-        subset='item_name', keep='first').head(5).to_dict('records')
 
-    format_all_numbers(final, 'count')
+def render_html(report_date: date, sales: pd.DataFrame,
+                timings: Optional[dict] = None) -> str:
+    """
+    Returns a html string that contains all the daily report analyses
+    of the sales made on the report date.
+    Every table is rendered from the section data in one pass of the report template.
+    """
+    if timings is None:
+        timings = {}
 
-    html_string = create_table_three_columns(
-        'Track', 'Copies Sold', 'Genres', final, 'item_name', 'count', 'genre')
+    sections = build_sections(sales, timings)
+
+    start = perf_counter()
+    html_string = REPORT_TEMPLATE.render(date=report_date.strftime('%d-%m-%Y'), **sections)
+    timings['html'] = perf_counter() - start
 
     return html_string
 
 
-def load_genre_data(db_connection: extensions.connection) -> pd.DataFrame:
+def generate_html_string(db_connection: extensions.connection,
+                         report_date: Optional[date] = None,
+                         timings: Optional[dict] = None) -> str:
     """
-    Loads the top 5 genres that have sold the most copies from the database
-    and converts it to a pandas dataframe
+    Returns a html string that contains all the daily report analyses
+    for the report date, which is the previous day if not given.
+    If a timings dictionary is given, the seconds taken by each step are added to it.
     """
+    if timings is None:
+        timings = {}
 
-    with db_connection.cursor() as curr:
+    if report_date is None:
+        report_date = get_yesterday()
 
-        curr.execute("""
-                    SELECT COUNT(sale_event.sale_id) as count, genre.genre
-                    FROM sale_event
-                    JOIN item
-                    ON item.item_id = sale_event.item_id
-                    JOIN item_genre
-                    ON item_genre.item_id = item.item_id
-                    JOIN genre
-                    ON genre.genre_id =item_genre.genre_id
-                    WHERE DATE(sale_time) = CURRENT_DATE - INTERVAL '1 day'
-                    GROUP BY genre.genre
-                    ORDER BY count DESC
-                    LIMIT 5;""")
-        tuples = curr.fetchall()
-        column_names = ['count', 'genre']
+    start = perf_counter()
+    sales = load_sales_data(db_connection, report_date)
+    timings['load_sales_data'] = perf_counter() - start
 
-        df = pd.DataFrame(tuples, columns=column_names)
+    return render_html(report_date, sales, timings)
 
-        return df
 
-
-def load_country_data(db_connection: extensions.connection) -> pd.DataFrame:
+def render_report(report_date: date, sales: pd.DataFrame, output_filename: str) -> str:
     """
-    Loads country data alongside the different artists selling in those countries
-    from the database and converts it into a pandas dataframe
+    Renders the pdf report of the sales made on the report date and returns its path.
     """
+    convert_html_to_pdf(render_html(report_date, sales), output_filename)
 
-    with db_connection.cursor() as curr:
-
-        curr.execute("""
-                    SELECT sale_event.sale_id, country.country, artist.artist_name
-                    FROM sale_event
-                    JOIN country
-                    ON country.country_id = sale_event.country_id
-                    JOIN item
-                    ON item.item_id = sale_event.item_id
-                    JOIN artist
-                    ON artist.artist_id = item.artist_id
-                    WHERE DATE(sale_time) = CURRENT_DATE - INTERVAL '1 day';""")
-        tuples = curr.fetchall()
-        column_names = ['sale_id', 'country', 'artist']
-
-        df = pd.DataFrame(tuples, columns=column_names)
-
-        return df
+    return output_filename
 
 
-def get_popular_genre(db_connection: extensions.connection) -> pd.DataFrame:
+def backfill(db_connection: extensions.connection, start_date: date, end_date: date,
+             output_dir: str, workers: Optional[int] = None) -> list[str]:
     """
-    Returns a html string of a table that contains information on
-    the top 5 genres and how many copies a genre has sold
+    Renders the report for every date from the start date to the end date into the
+    output directory and returns the paths of the pdfs. The sales for the whole range
+    are loaded with one query, and the reports are rendered in a pool of processes.
     """
-    genre_data = load_genre_data(db_connection)
+    report_dates = get_report_dates(start_date, end_date)
+    sales = load_sales_data(db_connection, start_date, end_date)
 
-    genres = genre_data.to_dict('records')
+    daily_sales = dict(tuple(sales.groupby('sale_date')))
+    no_sales = sales.iloc[0:0]
+    output_filenames = [path.join(output_dir, f"Bandcamp-Daily-Report-{report_date}.pdf")
+                        for report_date in report_dates]
 
-    format_all_numbers(genres, 'count')
-
-    html_string = create_table_two_columns(
-        'Genre', 'Copies Sold', genres, 'genre', 'count')
-
-    return html_string
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(render_report, report_dates,
+                                 [daily_sales.get(report_date, no_sales)
+                                  for report_date in report_dates],
+                                 output_filenames))
 
 
-def get_countries_insights(db_connection: extensions.connection) -> pd.DataFrame:
+def convert_html_to_pdf(source_html, output_filename, renderer: Optional[str] = None):
     """
-    Returns a html string of a table that contains information on
-    how many sales have occurred in every country and who the countries top artist is
+    Converts a html string into a pdf with the renderer named by PDF_RENDERER,
+    or the given renderer, and returns the number of errors.
     """
-    country_data = load_country_data(db_connection)
-    country_sales = country_data['country'].value_counts(
-    ).sort_values(ascending=False).reset_index()
+    if renderer is None:
+        renderer = environ.get("PDF_RENDERER", DEFAULT_RENDERER)
 
-    most_popular_artists = country_data.groupby('country')['artist'].apply(
-        lambda x: x.value_counts().idxmax()).reset_index()
+    return get_renderer(renderer)(source_html, output_filename)
 
-    final = pd.merge(country_sales, most_popular_artists).head(
-        10).to_dict('records')
 
-    format_all_numbers(final, 'count')
-
-    html_string = create_table_three_columns(
-        'Country', 'Number of Sales', 'Top Artist', final, 'country', 'count', 'artist')
+def load_subscribers(db_connection: extensions.connection) -> list[str]:
+    """Loads all the subscriber emails from the database into a pandas dataframe"""
 
-    return html_string
+    with db_connection.cursor() as curr:
 
+        curr.execute("""SELECT subscriber_email FROM subscribers;""")
+        tuples = curr.fetchall()
+        subscribers = []
+        for tuple in tuples:
+            subscribers.append(tuple[0])
 
-def generate_html_string(db_connection: extensions.connection) -> str:
-    """Returns a html string that contains all the daily report analyses"""
-
-    html_string = f"""
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=210mm, height=297mm", initial-scale=1.0">
-        <link rel="stylesheet" href="static/style.css">
-        </head>
-    <body>
-        <div>
-            <img class=title src="./bandcamp_logo.jpeg">
-            <h1 class=title> Bandcamp Report </h1>
-            <h1 class=date> {YESTERDAY_DATE} </h1>
-        </div>
-        <div class="new-page", class="footer">
-            <img class="header" src="./bandcamp_logo.jpeg"  style="width:200px;height:100px;">
-            <h2 class=header> Overview </h2>
-            <p> This is a daily report that contains the key analyses for <a href="https://bandcamp.com/">Bandcamp</a> data from {YESTERDAY_DATE}.
-                <br> The Bandcamp Tracker Report offers a detailed exploration of sales data, providing valuable insights into the music industry's dynamics.
-                    By analysing data from {YESTERDAY_DATE}, the report aims to offer a snapshot of trends and patterns in music purchases as well as trending genres and regional data
-            </p>
-            <h2 class=header> Contents </h2>
-            <p class=contents>
-                <br> Key Metrics </br>
-                <br> Top Performers </br>
-                <br> Sales Overview </br>
-                <br> Genre Analysis </br>
-                <br> Regional Analysis </br>
-            </p>
-        </div>
-        <div class="new-page" class="footer">
-            <img class="header" src="./bandcamp_logo.jpeg"  style="width:200px;height:100px;">
-            <h2 class="header"> Key Metrics </h2>
-            <p> This section delves into essential metrics that gauge the overall performance of the music marketplace on Bandcamp.
-            It includes the total number of sales, indicating the volume of transaction and the total income generated, offering a financial perspective.
-            </p>
-            {get_key_analytics(db_connection)}
-            <h2 class="header"> Top Performers </h2>
-            <p> Discover the artists who stand out as top performers in the sales landscape.
-                The report identifies the top 5 popular artists, showcasing those who have garnered the most attention, and the top 5 grossing artists,
-                highlighting those who have achieved the highest revenue through their music.
-            </p>
-            <div class="row">
-                <div class="column">
-                    {get_top_5_popular_artists(db_connection)}
-                </div>
-                <br>  </br>
-                <div class="column">
-                    {get_top_5_grossing_artists(db_connection)}
-                </div>
-            </div>
-        </div>
-        <div class="new-page" class="footer">
-            <img class="header" src="./bandcamp_logo.jpeg"  style="width:200px;height:100px;">
-            <h2 class="header"> Sales Overview </h2>
-            <p> Explore the top 5 albums and tracks, shedding light on the current preferences of Bandcamp users.
-                This section provides an overview of the most popular music items, giving insights into customer choices and potential trends.
-            </p>
-            <h3 class="subtitle"> Albums </h3>
-            <div class="row">
-                <div class="column">
-                    {get_top_5_sold_albums(db_connection)}
-                </div>
-                <div class="column">
-                    {get_top_5_grossing_albums(db_connection)}
-                </div>
-            </div>
-            <h3 class="subtitle"> Tracks </h3>
-            <div class="row">
-                <div class="column">
-                    {get_top_5_sold_tracks(db_connection)}
-                </div>
-                <div class="column">
-                    {get_top_5_grossing_tracks(db_connection)}
-                </div>
-            </div>
-        </div>
-        <div class="new-page" class="footer">
-            <img class="header" src="./bandcamp_logo.jpeg"  style="width:200px;height:100px;">
-            <h2 class="header"> Genre Analysis </h2>
-            <p> Dive into the diverse world of music genres with detailed analysis.
-                The report outlines the top 5 genres overall, the genres associated with the top 5 albums, and the genres of the top 5 tracks.
-                This analysis aims to uncover patterns in genre preferences and potential areas for genre-specific marketing strategies.
-            </p>
-            {get_popular_genre(db_connection)}
-            {get_album_genres(db_connection)}
-            {get_track_genres(db_connection)}
-        </div>
-        <div class="new-page" class="footer">
-            <img class="header" src="./bandcamp_logo.jpeg"  style="width:200px;height:100px;">
-            <h2 class="header"> Regional Insights </h2>
-            <p> Understand how music sales vary across different regions.
-                Highlighting countries with the most sales provides valuable geographical insights.
-                Additionally, identifying the most popular artists in each country offers a nuanced view of regional music preferences.
-            </p>
-            {get_countries_insights(db_connection)}
-    </div>
-    """
-    return html_string
+        return subscribers
 
 
-def convert_html_to_pdf(source_html, output_filename):
+class RateLimiter:
     """
-    Converts a html string into a pdf.
+    Spaces out calls across threads, so no more than rate calls start each second
     """
 
-    result_file = open(output_filename, "w+b")
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate
+        self.next_time = monotonic()
+        self.lock = Lock()
 
-    pisa_status = pisa.CreatePDF(
-        source_html,
-        dest=result_file)
+    def wait(self) -> None:
+        """
+        Waits until the next call is allowed to start.
+        """
+        with self.lock:
+            now = monotonic()
+            start_time = max(now, self.next_time)
+            self.next_time = start_time + self.interval
 
-    result_file.close()
+        sleep(start_time - now)
 
-    return pisa_status.err
 
+def get_ses_client():
+    """
+    Returns a client for AWS SES, created on first use and kept for as long as
+    the lambda container is warm. Throttled sends are retried with backoff.
+    """
+    global SES_CLIENT  # pylint: disable=global-statement
 
-def load_subscribers(db_connection: extensions.connection) -> list[str]:
-    """Loads all the subscriber emails from the database into a pandas dataframe"""
+    if SES_CLIENT is None:
+        SES_CLIENT = boto3.client("ses",
+                                  region_name="eu-west-2",
+                                  aws_access_key_id=environ["AWS_ACCESS_KEY_ID_"],
+                                  aws_secret_access_key=environ["AWS_SECRET_ACCESS_KEY_"],
+                                  config=Config(max_pool_connections=EMAIL_WORKERS,
+                                                retries={"mode": "standard"}))
+    return SES_CLIENT
 
-    with db_connection.cursor() as curr:
 
-        curr.execute("""SELECT subscriber_email FROM subscribers;""")
-        tuples = curr.fetchall()
-        subscribers = []
-        for tuple in tuples:
-            subscribers.append(tuple[0])
+def get_send_rate(client) -> float:
+    """
+    Returns the number of emails SES allows to be sent each second, which can be
+    set with SES_MAX_SEND_RATE instead of asking SES for the account's quota.
+    """
+    if "SES_MAX_SEND_RATE" in environ:
+        return float(environ["SES_MAX_SEND_RATE"])
 
-        return subscribers
+    try:
+        return client.get_send_quota()["MaxSendRate"]
+    except (ClientError, BotoCoreError):
+        return DEFAULT_SEND_RATE
 
 
-def send_email(db_connection: extensions.connection, report_file_path: str):
+def create_raw_email(report_file_path: str) -> str:
     """
-    Attaches the pdf to an email and sends the email
+    Returns the email, with the pdf attached, serialised once for every subscriber
     """
-
-    client = boto3.client("ses",
-                          region_name="eu-west-2",
-                          aws_access_key_id=environ["AWS_ACCESS_KEY_ID_"],
-                          aws_secret_access_key=environ["AWS_SECRET_ACCESS_KEY_"])
     message = MIMEMultipart()
     message["Subject"] = "Bandcamp Daily Report"
 
-    attachment = MIMEApplication(open(report_file_path, 'rb').read())
+    with open(report_file_path, 'rb') as report_file:
+        attachment = MIMEApplication(report_file.read())
     attachment.add_header('Content-Disposition',
                           'attachment', filename='Bandcamp-Daily-Report.pdf')
     message.attach(attachment)
 
-    subscribers = load_subscribers(db_connection)
-    for subscriber in subscribers:
-        try:
-            client.send_raw_email(
-                Source='trainee.ishika.madhav@sigmalabs.co.uk',
-                Destinations=[subscriber],
-                RawMessage={
-                    'Data': message.as_string()
-                }
-            )
+    return message.as_string()
 
-        except ClientError:
-            continue
+
+def send_raw_email(client, rate_limiter: RateLimiter, raw_email: str,
+                   subscriber: str) -> Optional[str]:
+    """
+    Sends the email to the subscriber and returns None, or the error if it failed
+    """
+    rate_limiter.wait()
+    try:
+        client.send_raw_email(
+            Source=SENDER_EMAIL,
+            Destinations=[subscriber],
+            RawMessage={
+                'Data': raw_email
+            }
+        )
+    except (ClientError, BotoCoreError) as error:
+        return str(error)
+
+    return None
+
+
+def send_email(subscribers: list[str], report_file_path: str) -> dict[str, str]:
+    """
+    Attaches the pdf to an email and sends the email to every subscriber,
+    from a few threads at once without going over the SES send rate.
+    Returns the error for each subscriber the email couldn't be sent to.
+    """
+    client = get_ses_client()
+    rate_limiter = RateLimiter(get_send_rate(client))
+    raw_email = create_raw_email(report_file_path)
+
+    with ThreadPoolExecutor(max_workers=EMAIL_WORKERS) as executor:
+        errors = executor.map(lambda subscriber: send_raw_email(
+            client, rate_limiter, raw_email, subscriber), subscribers)
+        failures = {subscriber: error
+                    for subscriber, error in zip(subscribers, errors) if error is not None}
+
+    for subscriber, error in failures.items():
+        print(f"Email to {subscriber} failed: {error}")
+
+    return failures
 
 
 def handler(event=None, context=None):
-    """Handler for the lambda function"""
+    """
+    Handler for the lambda function. The event can give the date of the report
+    as {"date": "YYYY-MM-DD"}, otherwise the report is for the previous day.
+    """
 
     load_dotenv()
 
-    connection = get_db_connection()
+    report_date = None
+    if event and event.get("date"):
+        report_date = date.fromisoformat(event["date"])
+
+    pool = get_connection_pool()
+
+    with ThreadPoolExecutor(max_workers=POOL_SIZE) as executor:
+        subscribers = executor.submit(run_with_connection, pool, load_subscribers)
 
-    html_string = generate_html_string(connection)
+        timings = {}
+        html_string = run_with_connection(pool, generate_html_string, report_date, timings)
 
-    pdf_file_path = '/tmp/Bandcamp-Daily-Report.pdf'
+        pdf_file_path = '/tmp/Bandcamp-Daily-Report.pdf'
 
-    convert_html_to_pdf(html_string, pdf_file_path)
-    print("Report created.")
+        start = perf_counter()
+        convert_html_to_pdf(html_string, pdf_file_path)
+        timings['pdf'] = perf_counter() - start
+        print("Report created.")
+        print_timings(timings)
 
-    send_email(connection, pdf_file_path)
-    print("Email sent.")
+        failures = send_email(subscribers.result(), pdf_file_path)
+        print(f"Email sent to {len(subscribers.result()) - len(failures)} subscribers, "
+              f"{len(failures)} failed.")
 
 
 if __name__ == "__main__":
 
+    parser = ArgumentParser(description="Creates the Bandcamp daily report.")
+    parser.add_argument("--date", type=date.fromisoformat, default=None,
+                        help="date of the report, YYYY-MM-DD (default: yesterday)")
+    parser.add_argument("--start-date", type=date.fromisoformat, default=None,
+                        help="first date to backfill reports for, YYYY-MM-DD")
+    parser.add_argument("--end-date", type=date.fromisoformat, default=None,
+                        help="last date to backfill reports for, YYYY-MM-DD")
+    parser.add_argument("--output-dir", default=".",
+                        help="folder to write the backfilled reports to")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of processes rendering backfilled reports "
+                        "(default: one per CPU)")
+    args = parser.parse_args()
+
+    backfill_range = args.start_date is not None or args.end_date is not None
+    if backfill_range and (args.start_date is None or args.end_date is None):
+        parser.error("--start-date and --end-date must be given together")
+    if backfill_range and args.date is not None:
+        parser.error("--date can't be given with --start-date and --end-date")
+
     t1_start = perf_counter()
 
     load_dotenv()
 
     connection = get_db_connection()
 
-    html_report = generate_html_string(connection)
+    if backfill_range:
+        reports = backfill(connection, args.start_date, args.end_date,
+                           args.output_dir, args.workers)
+        print(f"Created {len(reports)} reports in {perf_counter() - t1_start:.2f} seconds.")
+
+    else:
+        html_report = generate_html_string(connection, args.date)
 
-    pdf_file_path = './Bandcamp-Daily-Report.pdf'
+        pdf_file_path = './Bandcamp-Daily-Report.pdf'
 
-    convert_html_to_pdf(html_report, pdf_file_path)
+        convert_html_to_pdf(html_report, pdf_file_path)
 
-    t1_stop = perf_counter()
-    print("Elapsed time report 2 during the whole program in seconds:",
-          t1_stop-t1_start)
+        t1_stop = perf_counter()
+        print("Elapsed time report 2 during the whole program in seconds:",
+              t1_stop-t1_start)
 
-    send_email(connection, pdf_file_path)
+        send_email(load_subscribers(connection), pdf_file_path)
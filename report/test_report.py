@@ -0,0 +1,258 @@
+"""
+Tests the functions within report.py script
+"""
+
+from datetime import date
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+import pandas as pd
+from psycopg2 import OperationalError
+import pytest
+
+from renderers import get_renderer, render_with_xhtml2pdf
+
+from report import (
+    get_top_5_by_count,
+    get_top_5_by_revenue,
+    get_top_5_items_with_genres,
+    get_countries_insights,
+    build_sections,
+    run_with_connection,
+    get_report_dates,
+    render_report,
+    send_email,
+    get_send_rate,
+    DEFAULT_SEND_RATE,
+    RateLimiter,
+    REPORT_TEMPLATE,
+    ALBUM_TYPE_ID,
+    TRACK_TYPE_ID
+)
+
+
+@pytest.fixture
+def sales():
+    """
+    A dataframe of sales in the same shape as the one loaded from the database
+    """
+    return pd.DataFrame([
+        (1, 1000, 'Album A', ALBUM_TYPE_ID, 'artist a', 'France', ['rock', 'pop']),
+        (2, 500, 'Album A', ALBUM_TYPE_ID, 'artist a', 'France', ['rock', 'pop']),
+        (3, 2500, 'Album B', ALBUM_TYPE_ID, 'artist b', 'Germany', []),
+        (4, 100, 'Track C', TRACK_TYPE_ID, 'artist b', 'France', ['jazz']),
+        (5, 100, 'Track C', TRACK_TYPE_ID, 'artist b', 'Germany', ['jazz']),
+        (6, 100, 'Track C', TRACK_TYPE_ID, 'artist c', 'France', ['jazz']),
+    ], columns=['sale_id', 'amount', 'item_name', 'item_type_id',
+                'artist', 'country', 'genres'])
+
+
+class TestReportSections:
+    """
+    Class used for testing the sections computed from the sales dataframe
+    """
+
+    def test_top_5_by_count(self, sales):
+        """
+        Test whether values are ranked by how many sales they appear in
+        """
+        result = get_top_5_by_count(sales, 'item_name')
+
+        assert result.to_dict('records') == [
+            {'item_name': 'Track C', 'count': 3},
+            {'item_name': 'Album A', 'count': 2},
+            {'item_name': 'Album B', 'count': 1}]
+
+    def test_top_5_by_revenue(self, sales):
+        """
+        Test whether values are ranked by revenue in dollars
+        """
+        result = get_top_5_by_revenue(sales, 'artist')
+
+        assert result.to_dict('records') == [
+            {'artist': 'artist b', 'amount': 27.0},
+            {'artist': 'artist a', 'amount': 15.0},
+            {'artist': 'artist c', 'amount': 1.0}]
+
+    def test_items_without_genres_are_skipped(self, sales):
+        """
+        Test whether only items with genres are listed with their genres
+        """
+        result = get_top_5_items_with_genres(sales, ALBUM_TYPE_ID)
+
+        assert result == [
+            {'item_name': 'Album A', 'count': 2, 'genre': ['pop', 'rock']}]
+
+    def test_countries_insights(self, sales):
+        """
+        Test whether each country is listed with its number of sales and top artist
+        """
+        result = get_countries_insights(sales)
+
+        assert result == [
+            {'country': 'France', 'count': '4', 'artist': 'artist a'},
+            {'country': 'Germany', 'count': '2', 'artist': 'artist b'}]
+
+    def test_report_template(self, sales):
+        """
+        Test whether every section is rendered into the report, with names escaped
+        """
+        sales.loc[0, 'artist'] = 'artist <a>'
+        html = REPORT_TEMPLATE.render(date='01-01-2024', **build_sections(sales))
+
+        assert '<h1 class=date> 01-01-2024 </h1>' in html
+        assert '<td>$27.0</td>' in html
+        assert '<td>Track C</td>' in html
+        assert 'artist &lt;a&gt;' in html
+
+
+class TestBackfill:
+    """
+    Class used for testing creating reports for a range of dates
+    """
+
+    def test_report_dates(self):
+        """
+        Test whether every date in the range is included, both ends too
+        """
+        assert get_report_dates(date(2024, 2, 28), date(2024, 3, 1)) == [
+            date(2024, 2, 28), date(2024, 2, 29), date(2024, 3, 1)]
+
+    def test_end_date_before_start_date(self):
+        """
+        Test whether a range that ends before it starts raises an error
+        """
+        with pytest.raises(ValueError):
+            get_report_dates(date(2024, 3, 1), date(2024, 2, 28))
+
+    def test_render_report(self, sales, tmp_path):
+        """
+        Test whether a report is written for a date from its sales alone
+        """
+        output_filename = str(tmp_path / "Bandcamp-Daily-Report-2024-01-01.pdf")
+
+        assert render_report(date(2024, 1, 1), sales, output_filename) == output_filename
+        with open(output_filename, "rb") as pdf_file:
+            assert pdf_file.read(4) == b"%PDF"
+
+
+class TestConnectionPool:
+    """
+    Class used for testing taking connections from the pool
+    """
+
+    def test_stale_connection_is_replaced(self):
+        """
+        Test whether a connection the database has dropped is closed and replaced
+        """
+        stale, live = MagicMock(), MagicMock()
+        stale.cursor.return_value.__enter__.return_value.execute.side_effect = \
+            OperationalError("server closed the connection unexpectedly")
+        pool = MagicMock()
+        pool.getconn.side_effect = [stale, live]
+
+        result = run_with_connection(pool, lambda db_connection: db_connection)
+
+        assert result is live
+        assert pool.putconn.call_args_list[0].args == (stale,)
+        assert pool.putconn.call_args_list[0].kwargs == {'close': True}
+        pool.putconn.assert_called_with(live, close=False)
+
+    def test_connection_is_returned_when_function_fails(self):
+        """
+        Test whether a connection is put back in the pool, and kept open,
+        when the function fails with an error that isn't from the database
+        """
+        db_connection = MagicMock()
+        pool = MagicMock()
+        pool.getconn.return_value = db_connection
+
+        def fail(_):
+            raise ValueError("no sales")
+
+        with pytest.raises(ValueError):
+            run_with_connection(pool, fail)
+
+        pool.putconn.assert_called_once_with(db_connection, close=False)
+
+
+class TestRenderers:
+    """
+    Class used for testing the pdf renderers
+    """
+
+    def test_unknown_renderer(self):
+        """
+        Test whether asking for a renderer that doesn't exist raises an error
+        """
+        with pytest.raises(ValueError):
+            get_renderer("unknown")
+
+    def test_render_with_xhtml2pdf(self, tmp_path):
+        """
+        Test whether the default renderer writes a pdf without errors
+        """
+        output_filename = str(tmp_path / "report.pdf")
+
+        assert get_renderer()("<p>Bandcamp Report</p>", output_filename) == 0
+        assert get_renderer() is render_with_xhtml2pdf
+        with open(output_filename, "rb") as pdf_file:
+            assert pdf_file.read(4) == b"%PDF"
+
+
+class TestSendEmail:
+    """
+    Class used for testing sending the report to subscribers
+    """
+
+    def test_failures_are_collected(self, tmp_path):
+        """
+        Test whether every subscriber gets the same email and failed sends are returned
+        """
+        report_file_path = tmp_path / "report.pdf"
+        report_file_path.write_bytes(b"%PDF")
+
+        def send_raw_email(**kwargs):
+            if kwargs['Destinations'] == ['b@example.com']:
+                raise ClientError({'Error': {'Code': 'MessageRejected', 'Message': 'Rejected'}},
+                                  'SendRawEmail')
+            if kwargs['Destinations'] == ['d@example.com']:
+                raise EndpointConnectionError(endpoint_url='https://email.eu-west-2.amazonaws.com')
+
+        client = MagicMock()
+        client.send_raw_email.side_effect = send_raw_email
+
+        with patch('report.get_ses_client', return_value=client), \
+                patch.dict('report.environ', {'SES_MAX_SEND_RATE': '1000'}):
+            failures = send_email(['a@example.com', 'b@example.com',
+                                   'c@example.com', 'd@example.com'],
+                                  str(report_file_path))
+
+        assert list(failures) == ['b@example.com', 'd@example.com']
+        assert client.send_raw_email.call_count == 4
+        assert len({call.kwargs['RawMessage']['Data']
+                    for call in client.send_raw_email.call_args_list}) == 1
+
+    def test_send_rate_falls_back_to_default(self):
+        """
+        Test whether the default rate is used when SES can't be reached for the quota
+        """
+        client = MagicMock()
+        client.get_send_quota.side_effect = EndpointConnectionError(
+            endpoint_url='https://email.eu-west-2.amazonaws.com')
+
+        with patch.dict('report.environ', clear=True):
+            assert get_send_rate(client) == DEFAULT_SEND_RATE
+
+    def test_rate_limiter(self):
+        """
+        Test whether calls are spaced out by the rate
+        """
+        rate_limiter = RateLimiter(10)
+
+        with patch('report.sleep') as sleep:
+            for _ in range(3):
+                rate_limiter.wait()
+
+        assert sleep.call_args_list[0].args[0] <= 0
+        assert sleep.call_args_list[2].args[0] == pytest.approx(0.2, abs=0.01)